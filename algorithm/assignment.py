@@ -0,0 +1,197 @@
+from typing import List, Tuple, Hashable, Optional
+
+import numpy as np
+
+from algorithm.util import penalize_forbidden
+
+
+class IncrementalAssignment(object):
+    '''
+    minimal cost assignment of rows (agents) to columns (goals), kept optimal across small changes
+    the rectangular problem is padded to a square one with zero cost dummy rows or columns and solved by shortest
+    augmenting paths (Hungarian), the dual prices u, v and the matching survive between updates
+    on update, rows keep their position and columns are matched by key: a removed column frees its row, a row whose
+    matched edge is no longer tight is freed, then only the free rows are augmented
+    '''
+    num_row: int  # real rows, dummy rows follow
+    col_key: List[Optional[Hashable]]  # None for dummy columns
+    cost: np.ndarray  # (num_row, n) cost of the real rows, dummy rows cost 0
+    u: np.ndarray  # (n,) row prices
+    v: np.ndarray  # (n,) column prices
+    col4row: np.ndarray  # -1 if free
+    row4col: np.ndarray  # -1 if free
+    num_augment: int  # number of augmenting paths in the last update
+
+    def __init__(self):
+        super(IncrementalAssignment, self).__init__()
+        self.reset()
+
+    def reset(self):
+        self.num_row = -1
+        self.col_key = []
+        self.cost = np.zeros(shape=(0, 0), dtype=float)
+        self.u = np.zeros(shape=(0,), dtype=float)
+        self.v = np.zeros(shape=(0,), dtype=float)
+        self.col4row = np.zeros(shape=(0,), dtype=int)
+        self.row4col = np.zeros(shape=(0,), dtype=int)
+        self.num_augment = 0
+
+    def update(self, cost_matrix: np.ndarray, col_key: List[Hashable]) -> List[Tuple[int, int]]:
+        '''
+        :param cost_matrix: (rows, columns) non-negative cost matrix, inf for forbidden pairs
+        :param col_key: key of each column, columns with the same key as in the last update keep their price
+        :return: same as algorithm.util.linear_sum_assignment
+        '''
+        allowed = np.isfinite(cost_matrix)
+        if not allowed.all():
+            cost_matrix = penalize_forbidden(cost_matrix)
+        num_row, num_col = cost_matrix.shape
+        self.num_augment = 0
+        try:
+            if num_row != self.num_row:
+                self.__solve(cost_matrix, col_key)
+            else:
+                self.__repair(cost_matrix, col_key)
+        except ValueError:
+            self.reset()
+            raise
+        assignment: List[Tuple[int, int]] = []
+        for i in range(num_row):
+            j = self.col4row[i]
+            if j < num_col and allowed[i, j]:
+                assignment.append((i, j))
+        return assignment
+
+    def __solve(self, cost_matrix: np.ndarray, col_key: List[Hashable]):
+        num_row, num_col = cost_matrix.shape
+        n = max(num_row, num_col)
+        self.num_row = num_row
+        self.col_key = [*col_key, *([None] * (n - num_col))]
+        self.cost = np.zeros(shape=(num_row, n), dtype=float)
+        self.cost[:, :num_col] = cost_matrix
+        self.u = np.zeros(shape=(n,), dtype=float)
+        self.v = np.zeros(shape=(n,), dtype=float)
+        self.col4row = np.full(shape=(n,), fill_value=-1, dtype=int)
+        self.row4col = np.full(shape=(n,), fill_value=-1, dtype=int)
+        # rectangular problem first: column prices stay <= 0 and are 0 on the columns left free
+        for i in range(num_row):
+            self.__augment(i)
+        # then dummy rows take the free columns at price 0, which keeps the square duals feasible
+        free_col = np.flatnonzero(self.row4col < 0)
+        dummy_row = np.arange(num_row, n)
+        self.col4row[dummy_row] = free_col
+        self.row4col[free_col] = dummy_row
+
+    def __repair(self, cost_matrix: np.ndarray, col_key: List[Hashable]):
+        num_row, num_col = cost_matrix.shape
+        n = max(num_row, num_col)
+        old_n = len(self.v)
+        old_col = {key: j for j, key in enumerate(self.col_key) if key is not None}
+        # new column order: real columns as given, then dummy columns
+        # surviving real columns and, if still needed, old dummy columns keep their price and match
+        old_dummy_col = [j for j, key in enumerate(self.col_key) if key is None]
+        kept_col = np.array([
+            *[old_col.get(key, -1) for key in col_key],
+            *old_dummy_col[:n - num_col],
+            *([-1] * (n - num_col - min(n - num_col, len(old_dummy_col)))),
+        ], dtype=int)
+        new_col = kept_col < 0
+        old2new_col = np.full(shape=(old_n,), fill_value=-1, dtype=int)
+        old2new_col[kept_col[~new_col]] = np.flatnonzero(~new_col)
+        # every old dummy row is kept for now, the surplus is dropped once the free real rows are known
+        old_dummy_row = np.arange(self.num_row, old_n)
+        dummy_col4row = old2new_col[self.col4row[old_dummy_row]]
+        dummy_u = self.u[old_dummy_row]
+
+        cost = np.zeros(shape=(num_row, n), dtype=float)
+        cost[:, :num_col] = cost_matrix
+        v = np.zeros(shape=(n,), dtype=float)
+        v[~new_col] = self.v[kept_col[~new_col]]
+        # new columns get the largest price that keeps the duals feasible
+        if new_col.any():
+            v[new_col] = np.minimum(
+                (cost[:, new_col] - self.u[:num_row, None]).min(axis=0, initial=np.inf),
+                (-dummy_u).min(initial=np.inf),
+            )
+            v[new_col & ~np.isfinite(v)] = 0.0
+        # costs of the real rows changed, move their price to the largest feasible one
+        u_real = (cost - v[None, :]).min(axis=1, initial=np.inf)
+        if not np.isfinite(u_real).all():
+            raise ValueError("cost matrix is infeasible")
+        col4row_real = old2new_col[self.col4row[:num_row]]
+        matched = np.flatnonzero(col4row_real >= 0)
+        tight = cost[matched, col4row_real[matched]] - u_real[matched] - v[col4row_real[matched]] <= 1e-9
+        col4row_real[matched[~tight]] = -1
+
+        # keep n - num_row dummy rows: drop the ones whose column was removed, then the ones holding the cheapest
+        # column for a free real row, so that its augmenting path is short
+        keep = dummy_col4row >= 0
+        surplus = np.count_nonzero(keep) - (n - num_row)
+        for i in np.flatnonzero(col4row_real < 0):
+            if surplus <= 0:
+                break
+            candidate = np.flatnonzero(keep)
+            reduced = cost[i, dummy_col4row[candidate]] - v[dummy_col4row[candidate]]
+            keep[candidate[np.argmin(reduced)]] = False
+            surplus -= 1
+        if surplus > 0:
+            keep[np.flatnonzero(keep)[:surplus]] = False
+        dummy_u, dummy_col4row = dummy_u[keep], dummy_col4row[keep]
+        # new dummy rows get the largest feasible price
+        num_new_dummy = n - num_row - len(dummy_u)
+        dummy_u = np.concatenate([dummy_u, np.full(shape=(num_new_dummy,), fill_value=(-v).min(initial=0.0))])
+        dummy_col4row = np.concatenate([dummy_col4row, np.full(shape=(num_new_dummy,), fill_value=-1, dtype=int)])
+
+        self.num_row = num_row
+        self.col_key = [*col_key, *([None] * (n - num_col))]
+        self.cost = cost
+        self.u = np.concatenate([u_real, dummy_u])
+        self.v = v
+        self.col4row = np.concatenate([col4row_real, dummy_col4row])
+        self.row4col = np.full(shape=(n,), fill_value=-1, dtype=int)
+        self.row4col[self.col4row[self.col4row >= 0]] = np.flatnonzero(self.col4row >= 0)
+        for i in np.flatnonzero(self.col4row < 0):
+            self.__augment(i)
+
+    def __augment(self, cur_row: int):
+        # shortest augmenting path from a free row on reduced costs, see scipy rectangular_lsap
+        self.num_augment += 1
+        n = len(self.v)
+        zero = np.zeros(shape=(n,), dtype=float)
+        shortest = np.full(shape=(n,), fill_value=np.inf)
+        path = np.full(shape=(n,), fill_value=-1, dtype=int)
+        scanned_col = np.zeros(shape=(n,), dtype=bool)
+        scanned_row = []
+        i = cur_row
+        min_val = 0.0
+        while True:
+            scanned_row.append(i)
+            cost = self.cost[i] if i < self.num_row else zero
+            reduced = min_val + cost - self.u[i] - self.v
+            better = ~scanned_col & (reduced < shortest)
+            path[better] = i
+            shortest[better] = reduced[better]
+            remaining = np.where(scanned_col, np.inf, shortest)
+            min_val = remaining.min()
+            if min_val == np.inf:
+                raise ValueError("cost matrix is infeasible")
+            # prefer a free column among the closest ones
+            closest = remaining == min_val
+            free_closest = np.flatnonzero(closest & (self.row4col < 0))
+            j = free_closest[0] if len(free_closest) > 0 else np.flatnonzero(closest)[0]
+            scanned_col[j] = True
+            if self.row4col[j] < 0:
+                break
+            i = self.row4col[j]
+        # update prices
+        self.u[cur_row] += min_val
+        other_row = np.array(scanned_row[1:], dtype=int)
+        self.u[other_row] += min_val - shortest[self.col4row[other_row]]
+        self.v[scanned_col] -= min_val - shortest[scanned_col]
+        # flip the path
+        while True:
+            i = path[j]
+            self.row4col[j] = i
+            self.col4row[i], j = j, self.col4row[i]
+            if i == cur_row:
+                break
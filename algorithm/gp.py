@@ -2,78 +2,60 @@ from typing import List, Tuple, Any, Callable, Dict, Optional
 
 import numpy as np
 
-from algorithm.util import shortest_path, graph_partitioning, linear_sum_assignment, assignment_to_path
+from algorithm.grid import Graph
+from algorithm.util import shortest_path, geodesic_k_medoids, linear_sum_assignment, assignment_to_path, \
+    agent_goal_distance
 
 
-def graph_partitioning_controller(graph: np.ndarray, agent_list: List[int], goal_list: List[int]) -> List[List[int]]:
+def graph_partitioning_controller(graph: Graph, agent_list: List[int], goal_list: List[int]) -> \
+List[np.ndarray]:
     assignment, predecessor = graph_partitioning_assignment(graph, agent_list, goal_list)
     return assignment_to_path(agent_list, predecessor, assignment)
 
 
-def graph_partitioning_assignment(graph: np.ndarray, agent_list: List[int], goal_list: List[int]) -> Tuple[
-    List[Tuple[int, int]], Optional[Dict[int, np.ndarray]]]:
+def graph_partitioning_assignment(graph: Graph, agent_list: List[int], goal_list: List[int]) -> \
+Tuple[List[Tuple[int, int]], Optional[Dict[int, np.ndarray]]]:
     if len(agent_list) == 0 or len(goal_list) == 0:
         return [], None
 
     # calculate distances between agents and goals
-    indices = [*agent_list, *goal_list]
-    dist, predecessor = shortest_path(graph, indices)
+    dist, predecessor = shortest_path(graph, goal_list)
 
-    def nearest(dist: np.ndarray, indices: List[int]) -> int:
+    def nearest(a: int, indices: List[int]) -> int:
         idx = None
         minimal = float("inf")
-        for i in indices:
-            if dist[i] < minimal:
-                idx = i
-                minimal = dist[i]
+        for g in indices:
+            if dist[g][a] < minimal:
+                idx = g
+                minimal = dist[g][a]
         return idx
 
     # one agent, find nearest goal
     if len(agent_list) == 1:
         a = agent_list[0]
-        g = nearest(dist[a], goal_list)
+        g = nearest(a, goal_list)
+        if g is None:  # no goal is reachable
+            return [], predecessor
         return [(a, g)], predecessor
     # more agents than goals, convert to msoc
     if len(goal_list) < len(agent_list):
         # msoc
-        ag_dist_adj = np.empty(shape=(len(agent_list), len(goal_list)), dtype=float)
-        for h, a in enumerate(agent_list):
-            for w, g in enumerate(goal_list):
-                ag_dist_adj[h, w] = dist[a][g]
+        ag_dist_adj = agent_goal_distance(dist, agent_list, goal_list)
         # assign agents to goals
-        assignment_reduced = linear_sum_assignment(ag_dist_adj)
+        assignment_reduced = linear_sum_assignment(ag_dist_adj, candidate=16)
         assignment = [(agent_list[h], goal_list[w]) for h, w in assignment_reduced]
         return assignment, predecessor
 
-    # otherwise, partition the graph and assign each partition to an agent
-    inv_goal_dist = np.empty(shape=(len(goal_list), len(goal_list)), dtype=float)
-    for h, g_h in enumerate(goal_list):
-        for w, g_w in enumerate(goal_list):
-            d = dist[g_h][g_w]
-            if d == 0: d = 1.0
-            inv_goal_dist[h, w] = 1 / d
-
-    comm_reduced_list = graph_partitioning(inv_goal_dist, k=len(agent_list))
-    comm_list: List[List[int]] = []
-    for comm_reduced in comm_reduced_list:
-        comm_list.append([goal_list[i] for i in comm_reduced])
-
-    ac_dist = np.empty(shape=(len(agent_list), len(comm_list)), dtype=float)
-    for i_a, a in enumerate(agent_list):
-        for i_c, comm in enumerate(comm_list):
-            least_dist = float("inf")
-            for g in comm:
-                if dist[a][g] < least_dist:
-                    least_dist = dist[a][g]
-            ac_dist[i_a, i_c] = least_dist
+    # otherwise, partition the goals and assign each partition to an agent
+    goal_agent_dist = agent_goal_distance(dist, agent_list, goal_list).T
+    comm_reduced_list = geodesic_k_medoids(dist, goal_list, agent_list)
+    ac_dist = np.stack([goal_agent_dist[comm_reduced].min(axis=0) for comm_reduced in comm_reduced_list], axis=1)
 
     comm_reduced_assignment = linear_sum_assignment(ac_dist)
-    comm_assignment: List[Tuple[int, List[int]]] = []
-    for i_a, i_c in comm_reduced_assignment:
-        comm_assignment.append((agent_list[i_a], comm_list[i_c]))
-
     assignment: List[Tuple[int, int]] = []
-    for a, comm in comm_assignment:
-        g = nearest(dist[a], comm)
-        assignment.append((a, g))
+    for i_a, i_c in comm_reduced_assignment:
+        comm_reduced = comm_reduced_list[i_c]
+        # nearest goal of the partition
+        g = goal_list[comm_reduced[np.argmin(goal_agent_dist[comm_reduced, i_a])]]
+        assignment.append((agent_list[i_a], g))
     return assignment, predecessor
@@ -0,0 +1,271 @@
+from collections import OrderedDict
+from functools import cached_property
+from typing import List, Tuple, Union, Dict, Optional, TYPE_CHECKING
+
+import numpy as np
+import scipy as sp
+import scipy.sparse
+import scipy.sparse.csgraph
+
+from algorithm import trace
+
+if TYPE_CHECKING:
+    from algorithm.oracle import DistanceOracle
+    from algorithm.parallel import ParallelSearch
+
+# offset from a cell to the neighbour it is reached from
+_PARENT_OFFSET = np.array([(-1, 0), (+1, 0), (0, -1), (0, +1)])
+
+
+class FieldCache(object):
+    '''
+    least recently used distance and predecessor fields, keyed by source node
+    '''
+    max_bytes: int
+    num_bytes: int
+    field: "OrderedDict[int, Tuple[np.ndarray, np.ndarray]]"
+
+    def __init__(self, max_bytes: int = 1 << 28):
+        super(FieldCache, self).__init__()
+        self.max_bytes = max_bytes
+        self.num_bytes = 0
+        self.field = OrderedDict()
+
+    def __contains__(self, idx: int) -> bool:
+        return idx in self.field
+
+    def __len__(self) -> int:
+        return len(self.field)
+
+    def get(self, idx: int) -> Tuple[np.ndarray, np.ndarray]:
+        self.field.move_to_end(idx)
+        return self.field[idx]
+
+    def put(self, idx: int, dist: np.ndarray, predecessor: np.ndarray):
+        if idx in self.field:
+            self.__evict(idx)
+        self.field[idx] = (dist, predecessor)
+        self.num_bytes += dist.nbytes + predecessor.nbytes
+        while self.num_bytes > self.max_bytes and len(self.field) > 0:
+            self.__evict(next(iter(self.field)))
+
+    def clear(self):
+        self.field.clear()
+        self.num_bytes = 0
+
+    def __evict(self, idx: int):
+        dist, predecessor = self.field.pop(idx)
+        self.num_bytes -= dist.nbytes + predecessor.nbytes
+
+
+class Grid(object):
+    '''
+    4-connected grid graph over the free cells of an occupancy mask, every edge costs 1
+    the obstacles of a grid never change, so fields computed on it stay valid as long as the grid lives
+    '''
+    shape: Tuple[int, int]  # hw
+    free: np.ndarray  # (h, w) True on free cells
+    index2coord: np.ndarray  # (num_nodes, 2) hw of each node
+    coord2index: np.ndarray  # (h, w) node of each cell, -1 on obstacle
+    adj: sp.sparse.csr_matrix
+    cache: FieldCache
+    oracle: Optional["DistanceOracle"]  # see algorithm.oracle, stored distances of this layout
+    parallel: Optional["ParallelSearch"]  # see algorithm.parallel, searches missing sources over a pool of processes
+
+    @trace.traced("graph_build")
+    def __init__(self, free: np.ndarray, cache_bytes: int = 1 << 28):
+        super(Grid, self).__init__()
+        self.shape = free.shape
+        self.free = free
+        self.cache = FieldCache(cache_bytes)
+        self.oracle = None
+        self.parallel = None
+        # number free cells in row-major order
+        self.index2coord = np.argwhere(free)
+        num_nodes = len(self.index2coord)
+        self.coord2index = np.full(shape=self.shape, fill_value=-1, dtype=int)
+        self.coord2index[free] = np.arange(num_nodes)
+        # connect every free cell to its free right and bottom neighbour, both directions
+        src_list, dst_list = [], []
+        for src, dst in [
+            (self.coord2index[:, :-1], self.coord2index[:, 1:]),  # horizontal
+            (self.coord2index[:-1, :], self.coord2index[1:, :]),  # vertical
+        ]:
+            both_free = (src >= 0) & (dst >= 0)
+            src_list.append(src[both_free])
+            dst_list.append(dst[both_free])
+        row = np.concatenate([*src_list, *dst_list])
+        col = np.concatenate([*dst_list, *src_list])
+        self.adj = sp.sparse.csr_matrix(
+            (np.ones(shape=(len(row),), dtype=float), (row, col)),
+            shape=(num_nodes, num_nodes),
+        )
+
+    @cached_property
+    def neighbour(self) -> np.ndarray:
+        '''
+        neighbour[k, i]: node at _PARENT_OFFSET[k] from node i, -1 if it is not a free cell
+        '''
+        height, width = self.shape
+        coord = self.index2coord[None, :, :] + _PARENT_OFFSET[:, None, :]
+        in_range = (coord[:, :, 0] >= 0) & (coord[:, :, 0] < height) & (coord[:, :, 1] >= 0) & (coord[:, :, 1] < width)
+        neighbour = np.full(shape=in_range.shape, fill_value=-1, dtype=int)
+        neighbour[in_range] = self.coord2index[coord[:, :, 0][in_range], coord[:, :, 1][in_range]]
+        return neighbour
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.index2coord)
+
+    def shortest_path(self, indices: List[int]) -> Tuple[Dict[int, np.ndarray], Dict[int, np.ndarray]]:
+        '''
+        see algorithm.util.shortest_path, only sources missing from the cache and the oracle are searched
+        '''
+        dist: Dict[int, np.ndarray] = {}
+        predecessor: Dict[int, np.ndarray] = {}
+        for idx in indices:
+            if idx in self.cache:
+                dist[idx], predecessor[idx] = self.cache.get(idx)
+        missing = [idx for idx in dict.fromkeys(indices) if idx not in dist]
+        if self.oracle is not None:
+            for idx in missing:
+                if idx in self.oracle:
+                    dist[idx] = self.oracle.row(idx)
+                    predecessor[idx] = self.descend(dist[idx])
+                    self.cache.put(idx, dist[idx], predecessor[idx])
+            missing = [idx for idx in missing if idx not in dist]
+        if len(missing) > 0:
+            search = grid_shortest_path if self.parallel is None else self.parallel
+            dist_reduced, predecessor_reduced = search(self, missing)
+            for i, idx in enumerate(missing):
+                dist[idx], predecessor[idx] = dist_reduced[i].copy(), predecessor_reduced[i].copy()
+                self.cache.put(idx, dist[idx], predecessor[idx])
+        return dist, predecessor
+
+    def descend(self, dist: np.ndarray) -> np.ndarray:
+        '''
+        predecessors of a distance field, the first neighbour in _PARENT_OFFSET order one step closer to the source,
+        which is the parent the wavefront search picks
+        '''
+        neighbour_dist = np.where(self.neighbour >= 0, dist[self.neighbour], np.inf)
+        predecessor = self.neighbour[np.argmin(neighbour_dist, axis=0), np.arange(self.num_nodes)].astype(np.int32)
+        predecessor[(dist == 0) | ~np.isfinite(dist)] = -9999
+        return predecessor
+
+
+Graph = Union[sp.sparse.csr_matrix, Grid]
+
+
+def grid_shortest_path(grid: Grid, indices: List[int], batch_cells: int = 1 << 22) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    breadth-first search from many sources at once, one wavefront per distance
+    every cell holds a bitset of the sources that reached it, so one array operation advances 64 sources
+    batches that are too small to fill the bitsets for the diameter of the grid fall back to Dijkstra
+    :param grid: grid graph
+    :param indices: indices of source nodes
+    :param batch_cells: upper bound of (sources x cells) searched together, bounds the working memory
+    :return dist: dist[i, j]: distance from node indices[i] to node j, inf if unreachable
+    :return predecessor: predecessor[i, j]: node before node j on a shortest path from node indices[i]
+                         -9999 if j is indices[i] or unreachable
+    '''
+    indices = np.asarray(indices, dtype=int).reshape(-1)
+    dist = np.empty(shape=(len(indices), grid.num_nodes), dtype=float)
+    predecessor = np.empty(shape=(len(indices), grid.num_nodes), dtype=np.int32)
+    for begin, end, wavefront in grid_batch(grid, len(indices), batch_cells):
+        search_batch(grid, indices[begin:end], dist[begin:end], predecessor[begin:end], wavefront)
+    return dist, predecessor
+
+
+def grid_batch(grid: Grid, num_source: int, batch_cells: int = 1 << 22) -> List[Tuple[int, int, bool]]:
+    '''
+    :return: (begin, end, wavefront) of every batch of grid_shortest_path, wavefront if it searches by bitsets
+    '''
+    batch_size = 64 * max(1, batch_cells // (64 * grid.free.size))
+    return [
+        (begin, min(begin + batch_size, num_source), _prefer_wavefront(grid, min(batch_size, num_source - begin)))
+        for begin in range(0, num_source, batch_size)
+    ]
+
+
+def search_batch(grid: Grid, source: np.ndarray, dist: np.ndarray, predecessor: np.ndarray, wavefront: bool):
+    '''
+    search from sources into preallocated rows, every source gets the same row by either method whatever the other
+    sources are, so a batch can be split
+    '''
+    if wavefront:
+        _bitset_bfs(grid, source, dist, predecessor)
+    else:
+        dist[...], predecessor[...] = sp.sparse.csgraph.shortest_path(
+            method="D",  # Dijkstra
+            csgraph=grid.adj,
+            directed=True,
+            indices=source,
+            return_predecessors=True,
+        )
+
+
+def _prefer_wavefront(grid: Grid, num_source: int) -> bool:
+    # one wave costs about 3 Dijkstra node visits per word of 64 sources, a search takes about h + w waves
+    height, width = grid.shape
+    num_word = (num_source + 63) // 64
+    return 3 * (height + width) * num_word < num_source * np.log2(max(grid.num_nodes, 2))
+
+
+def _bitset_bfs(grid: Grid, source: np.ndarray, dist: np.ndarray, predecessor: np.ndarray):
+    height, width = grid.shape
+    num_source = len(source)
+    num_word = (num_source + 63) // 64
+    word, bit = np.divmod(np.arange(num_source), 64)
+    source_bit = np.left_shift(np.uint64(1), bit.astype(np.uint64))
+    h_source, w_source = grid.index2coord[source].T
+
+    # unvisited: free cells not reached yet, one bit per source
+    unvisited = np.zeros(shape=(num_word, height, width), dtype=np.uint64)
+    unvisited[:, grid.free] = ~np.uint64(0)
+    # frontier, padded by one cell on each side so that shifted views stay in bounds
+    frontier_pad = np.zeros(shape=(num_word, height + 2, width + 2), dtype=np.uint64)
+    frontier = frontier_pad[:, 1:-1, 1:-1]
+    np.bitwise_or.at(frontier, (word, h_source, w_source), source_bit)
+    unvisited ^= frontier
+    last_unvisited = np.empty_like(unvisited)
+    via = np.empty_like(unvisited)
+    # direction of the parent as two bit planes (index into _PARENT_OFFSET)
+    # bit p of the distance is the xor of unvisited over the waves d where bit p flips from d to d + 1
+    direction_plane = [np.zeros_like(unvisited), np.zeros_like(unvisited)]
+    dist_plane: List[np.ndarray] = []
+    d = 0
+    while True:
+        flip = d ^ (d + 1)
+        while flip >> len(dist_plane):
+            dist_plane.append(np.zeros_like(unvisited))
+        for p, plane in enumerate(dist_plane):
+            if (flip >> p) & 1:
+                plane ^= unvisited
+        d += 1
+        last_unvisited[...] = unvisited
+        for k, (dh, dw) in enumerate(_PARENT_OFFSET):
+            np.bitwise_and(frontier_pad[:, 1 + dh:height + 1 + dh, 1 + dw:width + 1 + dw], unvisited, out=via)
+            unvisited ^= via
+            if k & 1:
+                direction_plane[0] |= via
+            if k & 2:
+                direction_plane[1] |= via
+        np.bitwise_xor(last_unvisited, unvisited, out=frontier)
+        if not frontier.any():
+            break
+
+    # transpose the bit planes into (num_nodes, num_source) integers
+    plane_list = [plane[:, grid.free].T for plane in [unvisited, *direction_plane, *dist_plane]]
+    packed = np.stack(plane_list).view(np.uint8)  # (num_plane, num_nodes, 8 * num_word)
+    bits = np.unpackbits(packed, axis=2, count=num_source, bitorder="little")
+    unreached = bits[0].view(bool)
+    direction = bits[1] | (bits[2] << 1)
+    dist_type = np.uint16 if len(dist_plane) <= 16 else np.uint32
+    dist_int = np.zeros(shape=(grid.num_nodes, num_source), dtype=dist_type)
+    for p, dist_bit in enumerate(bits[3:]):
+        dist_int |= np.left_shift(dist_bit, p, dtype=dist_type)
+    parent = grid.neighbour[direction, np.arange(grid.num_nodes)[:, None]]
+    parent[unreached | (dist_int == 0)] = -9999
+    dist[...] = dist_int.T
+    dist[unreached.T] = np.inf
+    predecessor[...] = parent.T
@@ -0,0 +1,393 @@
+import weakref
+from typing import List, Tuple, Dict, Optional, Callable
+
+import numpy as np
+import scipy as sp
+import scipy.sparse
+import scipy.sparse.csgraph
+
+from algorithm import trace
+from algorithm.grid import Grid, FieldCache
+
+# local distances are stored as uint16, this marks unreachable cells
+_LOCAL_INF = np.iinfo(np.uint16).max
+
+
+class HierarchicalGrid(object):
+    '''
+    HPA* abstraction of a grid: the grid is cut into square chunks, the free cells on both sides of a chunk border are
+    entrances, entrances of the same chunk are joined by their distance inside the chunk
+    a field of a goal is a Dijkstra search over the entrances only, distances to other nodes go through the entrances
+    of their chunk, so they are upper bounds of the exact distances, exact inside the chunk of the goal
+    fields of chunks and goals are computed on demand and cached, nothing of the size of the grid is allocated
+    '''
+    grid: Grid
+    chunk: int  # side of a chunk in cells
+    horizon: int  # moves of a path refined at once
+    max_entry: int
+    num_chunk_col: int
+    node: np.ndarray  # (num_entrance,) grid node of each entrance, increasing
+    entrance_chunk: np.ndarray  # (num_entrance,) chunk of each entrance
+    entrance_slot: np.ndarray  # (num_entrance,) position of each entrance among the entrances of its chunk
+    chunk_entrance: np.ndarray  # (num_chunk, max_entrance_per_chunk) entrances of each chunk, padded by num_entrance
+    abstract: sp.sparse.csr_matrix  # (num_entrance, num_entrance) distances between neighbouring entrances
+    chunk_cache: FieldCache  # chunk -> (distance from each of its entrances to each of its nodes, its nodes)
+    goal_cache: FieldCache  # goal -> (distance from the goal to each entrance, distance to each node of its chunk)
+    entry_node: np.ndarray  # nodes of the entry table, increasing
+    entry_entrance: np.ndarray  # (num_entry, max_entrance_per_chunk) entrances of the chunk of each entry node
+    entry_dist: np.ndarray  # (num_entry, max_entrance_per_chunk) distance from each entry node to these entrances
+    last_entry: Tuple[np.ndarray, Tuple[np.ndarray, np.ndarray, np.ndarray]]
+
+    @trace.traced("hierarchy_build")
+    def __init__(self, grid: Grid, chunk: int = 32, horizon: Optional[int] = None,
+                 cache_bytes: int = 1 << 29, max_entry: int = 1 << 20):
+        '''
+        :param grid: grid graph
+        :param chunk: side of a chunk in cells, at most 181 so that local nodes fit in uint16
+        :param horizon: moves of a path refined at once, 2 x chunk if None
+        :param cache_bytes: bound of each of the chunk and goal caches
+        :param max_entry: bound of the nodes in the entry table, it starts over when full
+        '''
+        super(HierarchicalGrid, self).__init__()
+        self.grid = grid
+        self.chunk = chunk
+        self.horizon = 2 * chunk if horizon is None else horizon
+        self.max_entry = max_entry
+        self.chunk_cache = FieldCache(cache_bytes)
+        self.goal_cache = FieldCache(cache_bytes)
+        height, width = grid.shape
+        self.num_chunk_col = -(-width // chunk)
+        num_chunk = -(-height // chunk) * self.num_chunk_col
+        # crossings of vertical borders, then of horizontal borders, as pairs of grid nodes
+        row, col = _border_transition(grid.free, chunk)
+        col_t, row_t = _border_transition(grid.free.T, chunk)
+        src = np.concatenate([grid.coord2index[row, col - 1], grid.coord2index[row_t - 1, col_t]])
+        dst = np.concatenate([grid.coord2index[row, col], grid.coord2index[row_t, col_t]])
+        self.node = np.unique(np.concatenate([src, dst]))
+        num_entrance = len(self.node)
+        self.entrance_chunk = self.chunk_of(self.node)
+        order = np.argsort(self.entrance_chunk, kind="stable")
+        count = np.bincount(self.entrance_chunk, minlength=num_chunk)
+        offset = np.cumsum(count) - count
+        self.entrance_slot = np.empty(shape=(num_entrance,), dtype=int)
+        self.entrance_slot[order] = np.arange(num_entrance) - np.repeat(offset, count)
+        self.chunk_entrance = np.full(shape=(num_chunk, max(1, count.max(initial=0))), fill_value=num_entrance)
+        self.chunk_entrance[self.entrance_chunk, self.entrance_slot] = np.arange(num_entrance)
+        # inter edges cross a border, intra edges join the entrances of a chunk
+        row_list = [np.searchsorted(self.node, src), np.searchsorted(self.node, dst)]
+        col_list = row_list[::-1]
+        weight_list = [np.ones(shape=(2 * len(src),))]
+        for c in np.flatnonzero(count >= 2):
+            chunk_dist, node = self.chunk_field(c)
+            entrance = self.chunk_entrance[c, :count[c]]
+            pair_dist = chunk_dist[:, np.searchsorted(node, self.node[entrance])].astype(float)
+            pair_dist[pair_dist == _LOCAL_INF] = np.inf
+            # an edge as long as a detour over a third entrance of the chunk is left out, distances do not change
+            detour = pair_dist[:, :, None] + pair_dist[None, :, :]
+            detour[np.arange(count[c]), np.arange(count[c]), :] = np.inf
+            detour[:, np.arange(count[c]), np.arange(count[c])] = np.inf
+            i, j = np.nonzero(np.isfinite(pair_dist) & (pair_dist > 0) & (pair_dist < detour.min(axis=1)))
+            row_list.append(entrance[i])
+            col_list.append(entrance[j])
+            weight_list.append(pair_dist[i, j].astype(float))
+        self.abstract = sp.sparse.csr_matrix(
+            (np.concatenate(weight_list), (np.concatenate(row_list), np.concatenate(col_list))),
+            shape=(num_entrance, num_entrance),
+        )
+        self.abstract.sum_duplicates()  # a pair of entrances can only be joined once, this keeps the csr canonical
+        self.__clear_entry()
+
+    @property
+    def num_entrance(self) -> int:
+        return len(self.node)
+
+    def chunk_of(self, node: np.ndarray) -> np.ndarray:
+        coord = self.grid.index2coord[node]
+        return (coord[..., 0] // self.chunk) * self.num_chunk_col + coord[..., 1] // self.chunk
+
+    def chunk_field(self, c: int) -> Tuple[np.ndarray, np.ndarray]:
+        '''
+        :return dist: (num_entrance_of_chunk, num_node_of_chunk) uint16 distance inside chunk c from each entrance
+        :return node: grid nodes of chunk c, increasing
+        '''
+        if c in self.chunk_cache:
+            return self.chunk_cache.get(c)
+        node = self.chunk_node(c)
+        entrance = self.chunk_entrance[c]
+        entrance = entrance[entrance < self.num_entrance]
+        dist = self.__chunk_search(c, node, np.searchsorted(node, self.node[entrance]))
+        self.chunk_cache.put(c, dist, node)
+        return dist, node
+
+    def shortest_path(self, indices: List[int]) -> \
+            Tuple[Dict[int, "HierarchicalField"], Dict[int, "HierarchicalField"]]:
+        '''
+        see algorithm.util.shortest_path, both dicts hold the same lazy fields: field[nodes] are distances,
+        field.walk(a) is the next stretch of the path from a
+        '''
+        # fields of this call are kept even if they do not all fit in the cache
+        goal_field: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+        for g in indices:
+            if g in self.goal_cache:
+                goal_field[g] = self.goal_cache.get(g)
+        missing = [g for g in dict.fromkeys(indices) if g not in goal_field]
+        if len(missing) > 0:
+            goal_field.update(self.__goal_field(np.array(missing, dtype=int)))
+        field = {g: HierarchicalField(self, g, *goal_field[g]) for g in goal_field}
+        return field, field
+
+    def entry(self, node: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        '''
+        controllers ask every goal about the same nodes, the last answer is reused
+        :return entrance: (len(node), max_entrance_per_chunk) entrances of the chunk of each node, num_entrance pads
+        :return dist: (len(node), max_entrance_per_chunk) float32 distance inside the chunk to them, inf pads
+        :return chunk: (len(node),) chunk of each node
+        '''
+        last_node, last_entry = self.last_entry
+        if len(last_node) == len(node) and (last_node == node).all():
+            return last_entry
+        position = np.searchsorted(self.entry_node, node)
+        known = position < len(self.entry_node)
+        known[known] = self.entry_node[position[known]] == node[known]
+        if not known.all():
+            new_node = np.unique(node[~known])
+            if len(self.entry_node) + len(new_node) > self.max_entry:
+                self.__clear_entry()
+            self.__add_entry(new_node)
+            position = np.searchsorted(self.entry_node, node)
+        self.last_entry = node.copy(), (self.entry_entrance[position], self.entry_dist[position], self.chunk_of(node))
+        return self.last_entry[1]
+
+    def local_predecessor(self, c: int, node: np.ndarray, dist: np.ndarray) -> np.ndarray:
+        '''
+        :param dist: uint16 distance field over the nodes of chunk c
+        :return: local next hop of each node of chunk c down the field, -1 at its source or if unreachable
+        '''
+        neighbour = self.__chunk_neighbour(c, node)
+        neighbour_dist = np.where(neighbour >= 0, dist[neighbour], _LOCAL_INF)
+        predecessor = neighbour[np.argmin(neighbour_dist, axis=0), np.arange(len(node))]
+        predecessor[(dist == 0) | (dist == _LOCAL_INF)] = -1
+        return predecessor
+
+    def __goal_field(self, goal: np.ndarray, batch_size: int = 64) -> Dict[int, Tuple[np.ndarray, np.ndarray]]:
+        # distances inside the chunk of every goal, chunk by chunk
+        goal_chunk = self.chunk_of(goal)
+        local_dist: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+        for c in np.unique(goal_chunk):
+            chunk_goal = goal[goal_chunk == c]
+            node = self.chunk_node(c)
+            dist = self.__chunk_search(c, node, np.searchsorted(node, chunk_goal))
+            for g, row in zip(chunk_goal.tolist(), dist):
+                local_dist[g] = row, node
+        # Dijkstra over the entrances from one virtual node per goal, joined to the entrances of its chunk
+        # the virtual edges point away from the virtual nodes and cost 1 more, so that no search passes another goal
+        num_entrance = self.num_entrance
+        abstract = self.abstract.tocoo()
+        computed: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+        for begin in range(0, len(goal), batch_size):
+            batch = goal[begin:begin + batch_size]
+            virtual_list, entrance_list, weight_list = [], [], []
+            for b, g in enumerate(batch.tolist()):
+                row, node = local_dist[g]
+                entrance = self.chunk_entrance[goal_chunk[begin + b]]
+                entrance = entrance[entrance < num_entrance]
+                weight = row[np.searchsorted(node, self.node[entrance])]
+                reachable = weight != _LOCAL_INF
+                virtual_list.append(np.full(shape=(np.count_nonzero(reachable),), fill_value=num_entrance + b))
+                entrance_list.append(entrance[reachable])
+                weight_list.append(weight[reachable] + 1.0)
+            size = num_entrance + len(batch)
+            augmented = sp.sparse.csr_matrix(
+                (
+                    np.concatenate([abstract.data, *weight_list]),
+                    (np.concatenate([abstract.row, *virtual_list]), np.concatenate([abstract.col, *entrance_list])),
+                ),
+                shape=(size, size),
+            )
+            dist = sp.sparse.csgraph.dijkstra(
+                csgraph=augmented,
+                directed=True,
+                indices=np.arange(num_entrance, size),
+            )
+            for b, g in enumerate(batch.tolist()):
+                # the last slot is the distance of the padding entrance
+                abstract_dist = np.full(shape=(num_entrance + 1,), fill_value=np.inf, dtype=np.float32)
+                abstract_dist[:num_entrance] = dist[b, :num_entrance] - 1.0
+                computed[g] = abstract_dist, local_dist[g][0]
+                self.goal_cache.put(g, *computed[g])
+        return computed
+
+    def chunk_node(self, c: int) -> np.ndarray:
+        '''
+        :return: grid nodes of chunk c, increasing
+        '''
+        h, w = divmod(int(c), self.num_chunk_col)
+        block = np.s_[h * self.chunk:(h + 1) * self.chunk, w * self.chunk:(w + 1) * self.chunk]
+        node = self.grid.coord2index[block]
+        return node[node >= 0]
+
+    def __chunk_neighbour(self, c: int, node: np.ndarray) -> np.ndarray:
+        # neighbour[k, i]: local index of the node next to local node i in direction k, -1 outside the chunk
+        h, w = divmod(int(c), self.num_chunk_col)
+        local = np.full(shape=(self.chunk + 2, self.chunk + 2), fill_value=-1)
+        coord = self.grid.index2coord[node] - [h * self.chunk - 1, w * self.chunk - 1]
+        local[coord[:, 0], coord[:, 1]] = np.arange(len(node))
+        return np.stack([local[coord[:, 0] + dh, coord[:, 1] + dw] for dh, dw in [(-1, 0), (1, 0), (0, -1), (0, 1)]])
+
+    def __chunk_search(self, c: int, node: np.ndarray, source: np.ndarray) -> np.ndarray:
+        # breadth-first search inside chunk c from local sources, as uint16
+        if len(source) == 0:
+            return np.zeros(shape=(0, len(node)), dtype=np.uint16)
+        neighbour = self.__chunk_neighbour(c, node)
+        k, i = np.nonzero(neighbour >= 0)
+        adj = sp.sparse.csr_matrix((np.ones(shape=(len(i),)), (i, neighbour[k, i])), shape=(len(node), len(node)))
+        dist = sp.sparse.csgraph.shortest_path(adj, method="D", directed=True, unweighted=True, indices=source)
+        dist = np.atleast_2d(dist)
+        dist[~np.isfinite(dist)] = _LOCAL_INF
+        return dist.astype(np.uint16)
+
+    def __clear_entry(self):
+        width = self.chunk_entrance.shape[1]
+        self.entry_node = np.zeros(shape=(0,), dtype=int)
+        self.entry_entrance = np.zeros(shape=(0, width), dtype=int)
+        self.entry_dist = np.zeros(shape=(0, width), dtype=np.float32)
+        self.last_entry = self.entry_node, (self.entry_entrance, self.entry_dist, self.entry_node)
+
+    def __add_entry(self, new_node: np.ndarray):
+        new_chunk = self.chunk_of(new_node)
+        entrance = self.chunk_entrance[new_chunk]
+        dist = np.full(shape=entrance.shape, fill_value=np.inf, dtype=np.float32)
+        for c in np.unique(new_chunk):
+            member = np.flatnonzero(new_chunk == c)
+            chunk_dist, node = self.chunk_field(c)
+            local = chunk_dist[:, np.searchsorted(node, new_node[member])].T.astype(np.float32)
+            local[local == _LOCAL_INF] = np.inf
+            dist[member, :local.shape[1]] = local
+        self.entry_node = np.concatenate([self.entry_node, new_node])
+        self.entry_entrance = np.concatenate([self.entry_entrance, entrance])
+        self.entry_dist = np.concatenate([self.entry_dist, dist])
+        order = np.argsort(self.entry_node)
+        self.entry_node = self.entry_node[order]
+        self.entry_entrance = self.entry_entrance[order]
+        self.entry_dist = self.entry_dist[order]
+
+
+class HierarchicalField(object):
+    '''
+    distances to one goal and paths toward it on a hierarchical grid
+    field[nodes] goes through the entrances of the chunk of each node, or straight to the goal inside its chunk
+    '''
+    hierarchy: HierarchicalGrid
+    goal: int
+    goal_chunk: int
+    abstract_dist: np.ndarray  # (num_entrance + 1,) float32 distance from each entrance to the goal
+    goal_node: np.ndarray  # nodes of the chunk of the goal, increasing
+    local_dist: np.ndarray  # uint16 distance from each of them to the goal
+
+    def __init__(self, hierarchy: HierarchicalGrid, goal: int, abstract_dist: np.ndarray, local_dist: np.ndarray):
+        super(HierarchicalField, self).__init__()
+        self.hierarchy = hierarchy
+        self.goal = goal
+        self.goal_chunk = int(hierarchy.chunk_of(goal))
+        self.abstract_dist = abstract_dist
+        self.goal_node = hierarchy.chunk_node(self.goal_chunk)
+        self.local_dist = local_dist
+
+    def __getitem__(self, node):
+        node_array = np.asarray(node, dtype=int).reshape(-1)
+        entrance, dist, chunk = self.hierarchy.entry(node_array)
+        dist = (dist + self.abstract_dist[entrance]).min(axis=1).astype(float)
+        same = chunk == self.goal_chunk
+        if same.any():
+            local = self.__local(node_array[same]).astype(float)
+            local[local == _LOCAL_INF] = np.inf
+            dist[same] = np.minimum(dist[same], local)
+        return dist[0] if np.ndim(node) == 0 else dist
+
+    def walk(self, a: int) -> List[int]:
+        '''
+        :return: path from a toward the goal, at most horizon moves, only a if the goal is unreachable
+        '''
+        hierarchy = self.hierarchy
+        path = [a]
+        while path[-1] != self.goal and len(path) <= hierarchy.horizon:
+            a = path[-1]
+            stretch = self.__stretch(a)
+            if stretch is None:
+                break
+            target, c, dist = stretch
+            if dist is None:  # across a chunk border
+                path.append(target)
+                continue
+            # down the local field of the target, it lowers the distance to the goal by one each move
+            node = hierarchy.chunk_node(c)
+            predecessor = hierarchy.local_predecessor(c, node, dist)
+            local = int(np.searchsorted(node, a))
+            while predecessor[local] >= 0 and len(path) <= hierarchy.horizon:
+                local = predecessor[local]
+                path.append(int(node[local]))
+        return path
+
+    def __stretch(self, a: int) -> Optional[Tuple[int, int, Optional[np.ndarray]]]:
+        # next target of a: (node, chunk, local field to walk down) or (neighbour across the border, chunk, None)
+        hierarchy = self.hierarchy
+        entrance, dist, chunk = hierarchy.entry(np.array([a]))
+        c = int(chunk[0])
+        via = dist[0] + self.abstract_dist[entrance[0]]
+        k = int(np.argmin(via))
+        if c == self.goal_chunk:
+            local = self.__local(np.array([a]))[0]
+            if local != _LOCAL_INF and local <= via[k]:
+                return self.goal, c, self.local_dist
+        if not np.isfinite(via[k]):
+            return None
+        e = entrance[0, k]
+        if dist[0, k] > 0:
+            return int(hierarchy.node[e]), c, hierarchy.chunk_field(c)[0][k]
+        # a is the entrance, follow the abstract edge that realises its distance
+        begin, end = hierarchy.abstract.indptr[e], hierarchy.abstract.indptr[e + 1]
+        neighbour = hierarchy.abstract.indices[begin:end]
+        n = neighbour[np.argmin(hierarchy.abstract.data[begin:end] + self.abstract_dist[neighbour])]
+        if hierarchy.entrance_chunk[n] != c:
+            return int(hierarchy.node[n]), c, None
+        return int(hierarchy.node[n]), c, hierarchy.chunk_field(c)[0][hierarchy.entrance_slot[n]]
+
+    def __local(self, node: np.ndarray) -> np.ndarray:
+        return self.local_dist[np.searchsorted(self.goal_node, node)]
+
+
+def hierarchical_controller(controller: Callable, **kwargs) -> Callable:
+    '''
+    run an auto controller on the hierarchical abstraction of its grid, built once per grid
+    :param controller: auto controller that plans through algorithm.util.shortest_path
+    :param kwargs: see HierarchicalGrid
+    :return: auto controller
+    '''
+    hierarchy_of: "weakref.WeakKeyDictionary[Grid, HierarchicalGrid]" = weakref.WeakKeyDictionary()
+
+    def hierarchical(graph: Grid, agent_list: List[int], goal_list: List[int]) -> List[np.ndarray]:
+        if graph not in hierarchy_of:
+            hierarchy_of[graph] = HierarchicalGrid(graph, **kwargs)
+        return controller(hierarchy_of[graph], agent_list, goal_list)
+
+    return hierarchical
+
+
+def _border_transition(free: np.ndarray, chunk: int, min_long: int = 7) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    crossings of the vertical chunk borders, as in HPA*: a stretch of a border inside one chunk where the cells on both
+    sides are free is crossed in its middle, or at both ends if it is at least min_long cells long
+    :return: row, col: crossing from cell (row, col - 1) to cell (row, col)
+    '''
+    height, width = free.shape
+    border = np.arange(chunk, width, chunk)
+    both = (free[:, border - 1] & free[:, border]).T  # (num_border, height)
+    padded = np.pad(both, ((0, 0), (1, 1)))
+    offset = np.arange(height) % chunk
+    begin = both & (~padded[:, :-2] | (offset == 0))
+    end = both & (~padded[:, 2:] | (offset == chunk - 1))
+    j, first = np.nonzero(begin)
+    _, last = np.nonzero(end)
+    long = last - first + 1 >= min_long
+    row = np.concatenate([(first[~long] + last[~long]) // 2, first[long], last[long]])
+    return row, border[np.concatenate([j[~long], j[long], j[long]])]
@@ -0,0 +1,159 @@
+import heapq
+from typing import List, Dict, Tuple, Set, Optional
+
+import numpy as np
+import scipy as sp
+import scipy.sparse
+
+from algorithm.grid import Graph, Grid
+from algorithm.util import shortest_path, bottleneck_assignment, linear_sum_assignment, assignment_to_path, \
+    agent_goal_distance
+
+
+def makespan_controller(graph: Graph, agent_list: List[int], goal_list: List[int], reserve: bool = True,
+                        bottleneck: bool = False) -> List[np.ndarray]:
+    '''
+    plan for the time the last goal is reached instead of the sum of path lengths
+    every goal goes into the tour of some agent so that the longest tour stays short, agents head for the first goal of
+    their tour, agents with a longer tour plan first and later ones avoid the cells and edges they hold at each tick
+    :param graph: grid or adjacency matrix, every edge takes one tick
+    :param agent_list: list of agents
+    :param goal_list: list of goals
+    :param reserve: avoid vertex and edge conflicts with a space-time reservation table
+    :param bottleneck: see build_tour
+    :return: path from agents to the first goal of their tour, a repeated node is a wait
+    '''
+    if len(agent_list) == 0 or len(goal_list) == 0:
+        return [np.array([a], dtype=np.int32) for a in agent_list]
+    dist, predecessor = shortest_path(graph, goal_list)
+    tour_list, tour_length = build_tour(dist, agent_list, goal_list, bottleneck)
+    if not reserve:
+        assignment = [(a, tour[0]) for a, tour in zip(agent_list, tour_list) if len(tour) > 0]
+        return assignment_to_path(agent_list, predecessor, assignment)
+
+    adj = graph.adj if isinstance(graph, Grid) else graph
+    table = ReservationTable()
+    path_list: List[Optional[np.ndarray]] = [None] * len(agent_list)
+    for i, (a, tour) in enumerate(zip(agent_list, tour_list)):
+        if len(tour) == 0:  # idle agents stay where they are
+            path_list[i] = np.array([a], dtype=np.int32)
+            table.block(a)
+    for i in np.argsort(-tour_length, kind="stable"):
+        if path_list[i] is not None:
+            continue
+        a, g = agent_list[i], tour_list[i][0]
+        path = space_time_path(adj, dist[g], a, g, table)
+        if path is None:  # no conflict-free path within the horizon
+            path = assignment_to_path([a], predecessor, [(a, g)])[0]
+        else:
+            table.reserve(path)
+        path_list[i] = path
+    return path_list
+
+
+def build_tour(dist: Dict[int, np.ndarray], agent_list: List[int], goal_list: List[int], bottleneck: bool = False) -> \
+Tuple[List[List[int]], np.ndarray]:
+    '''
+    split the goals into one tour per agent that keeps the longest tour short
+    the first goals are a minimal sum of costs assignment, or a bottleneck one, the other goals are appended one by one
+    to the tour that ends the earliest with them
+    with a replan at every pickup the first goals decide the episode, and the bottleneck ones serve far goals too early
+    :return tour_list: goals of each agent in visiting order, unreachable goals are left out
+    :return tour_length: length of each tour
+    '''
+    goal = np.asarray(goal_list, dtype=int)
+    ag_dist = agent_goal_distance(dist, agent_list, goal_list)
+    tour_list: List[List[int]] = [[] for _ in agent_list]
+    tour_length = np.zeros(shape=(len(agent_list),), dtype=float)
+    end_dist = np.full(shape=ag_dist.shape, fill_value=np.inf)  # end_dist[i, j]: from the end of tour i to goal j
+    open_goal = np.ones(shape=(len(goal_list),), dtype=bool)
+    first = bottleneck_assignment(ag_dist) if bottleneck else linear_sum_assignment(ag_dist, candidate=16)
+    for i, j in first:
+        tour_list[i].append(goal_list[j])
+        tour_length[i] = ag_dist[i, j]
+        end_dist[i] = dist[goal_list[j]][goal]
+        open_goal[j] = False
+    # min-min insertion: append the goal that ends the shortest tour, until no reachable goal is left
+    while True:
+        cost = np.where(open_goal[None, :], tour_length[:, None] + end_dist, np.inf)
+        i, j = np.unravel_index(np.argmin(cost), cost.shape)
+        if not np.isfinite(cost[i, j]):
+            break
+        tour_list[i].append(goal_list[j])
+        tour_length[i] = cost[i, j]
+        end_dist[i] = dist[goal_list[j]][goal]
+        open_goal[j] = False
+    return tour_list, tour_length
+
+
+class ReservationTable(object):
+    '''
+    cells and edges held by planned agents at each tick
+    an agent holds the cells of its path until it reaches its goal, a blocked cell is held at every tick
+    '''
+    vertex: Set[Tuple[int, int]]  # (tick, node)
+    edge: Set[Tuple[int, int, int]]  # (tick, from node, to node), the move ends at tick
+    blocked: Set[int]
+
+    def __init__(self):
+        super(ReservationTable, self).__init__()
+        self.vertex = set()
+        self.edge = set()
+        self.blocked = set()
+
+    def free(self, t: int, u: int, v: int) -> bool:
+        '''
+        :return: True if moving (or waiting) from u to v and arriving at tick t conflicts with no planned agent
+        '''
+        return v not in self.blocked and (t, v) not in self.vertex and (t, v, u) not in self.edge
+
+    def reserve(self, path: np.ndarray):
+        node_list = path.tolist()
+        for t, v in enumerate(node_list):
+            self.vertex.add((t, v))
+            if t > 0:
+                self.edge.add((t, node_list[t - 1], v))
+
+    def block(self, v: int):
+        self.blocked.add(v)
+
+
+def space_time_path(adj: sp.sparse.csr_matrix, goal_dist: np.ndarray, a: int, g: int, table: ReservationTable,
+                    max_delay: int = 32) -> Optional[np.ndarray]:
+    '''
+    A* over (node, tick) with waits, the distance field of the goal is an exact heuristic
+    :param adj: adjacency matrix
+    :param goal_dist: distance from the goal to every node
+    :param a: start node at tick 0
+    :param g: goal node
+    :param table: reservations of the agents planned before
+    :param max_delay: ticks of waiting or detour allowed over the shortest path
+    :return: node of the agent at each tick, None if there is no such path
+    '''
+    if not np.isfinite(goal_dist[a]):
+        return None
+    horizon = int(goal_dist[a]) + max_delay
+    parent: Dict[Tuple[int, int], Tuple[int, int]] = {}
+    # (f, -t, node, t): among equal f, prefer the deepest state
+    heap: List[Tuple[float, int, int, int]] = [(goal_dist[a], 0, a, 0)]
+    closed: Set[Tuple[int, int]] = set()
+    while len(heap) > 0:
+        _, _, u, t = heapq.heappop(heap)
+        if (u, t) in closed:
+            continue
+        closed.add((u, t))
+        if u == g:
+            path = [u]
+            while (u, t) in parent:
+                u, t = parent[(u, t)]
+                path.append(u)
+            return np.array(path[::-1], dtype=np.int32)
+        if t >= horizon:
+            continue
+        for v in [u, *adj.indices[adj.indptr[u]:adj.indptr[u + 1]].tolist()]:
+            if (v, t + 1) in closed or not table.free(t + 1, u, v):
+                continue
+            if (v, t + 1) not in parent:
+                parent[(v, t + 1)] = (u, t)
+                heapq.heappush(heap, (t + 1 + goal_dist[v], -(t + 1), v, t + 1))
+    return None
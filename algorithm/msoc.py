@@ -1,24 +1,44 @@
-from typing import List, Dict
+from typing import List, Dict, Callable
 import numpy as np
 
-from algorithm.util import shortest_path, linear_sum_assignment, assignment_to_path
+from algorithm.assignment import IncrementalAssignment
+from algorithm.grid import Graph
+from algorithm.util import shortest_path, linear_sum_assignment, assignment_to_path, agent_goal_distance
 
 
-def minimal_sum_of_costs_controller(graph: np.ndarray, agent_list: List[int], goal_list: List[int]) -> List[List[int]]:
+def minimal_sum_of_costs_controller(graph: Graph, agent_list: List[int], goal_list: List[int], candidate: int = 16) -> \
+List[np.ndarray]:
     '''
-    :param graph: adjacency matrix
+    :param graph: grid or adjacency matrix
     :param agent_list: list of agents
     :param goal_list: list of goals
+    :param candidate: nearest goals kept per agent on large problems, see algorithm.util.linear_sum_assignment
     :return: path from agents to goals
     '''
     # calculate distances between agents and goals
-    indices = [*agent_list, *goal_list]
-    dist, predecessor = shortest_path(graph, indices)
-    ag_dist_adj = np.empty(shape=(len(agent_list), len(goal_list)), dtype=float)
-    for h, a in enumerate(agent_list):
-        for w, g in enumerate(goal_list):
-            ag_dist_adj[h, w] = dist[a][g]
+    dist, predecessor = shortest_path(graph, goal_list)
+    ag_dist_adj = agent_goal_distance(dist, agent_list, goal_list)
     # assign agents to goals
-    assignment_reduced = linear_sum_assignment(ag_dist_adj)
+    assignment_reduced = linear_sum_assignment(ag_dist_adj, candidate=candidate)
     assignment = [(agent_list[h], goal_list[w]) for h, w in assignment_reduced]
     return assignment_to_path(agent_list, predecessor, assignment)
+
+
+def incremental_minimal_sum_of_costs_controller() -> Callable[[Graph, List[int], List[int]], List[np.ndarray]]:
+    '''
+    minimal_sum_of_costs_controller that repairs the assignment of the previous call instead of solving it again
+    agents are matched to the previous call by their position in agent_list, goals by their index
+    an agent that walked k steps along its shortest path keeps its goal at its price minus k, so after a pickup only
+    the agent of the reached goal is re-assigned
+    :return: auto controller
+    '''
+    incremental_assignment = IncrementalAssignment()
+
+    def controller(graph: Graph, agent_list: List[int], goal_list: List[int]) -> List[np.ndarray]:
+        dist, predecessor = shortest_path(graph, goal_list)
+        ag_dist_adj = agent_goal_distance(dist, agent_list, goal_list)
+        assignment_reduced = incremental_assignment.update(ag_dist_adj, goal_list)
+        assignment = [(agent_list[h], goal_list[w]) for h, w in assignment_reduced]
+        return assignment_to_path(agent_list, predecessor, assignment)
+
+    return controller
@@ -0,0 +1,103 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from typing import Optional
+
+import numpy as np
+
+from algorithm.grid import Grid, grid_shortest_path
+
+
+class DistanceOracle(object):
+    '''
+    distances from a fixed set of sources on one obstacle layout, as a read only memory map that every process running
+    episodes on the layout shares through the page cache
+    all pairs on small layouts, chosen sources (depots, customer sites) on large ones
+    '''
+    key: str  # hash of the obstacle mask
+    source: np.ndarray  # (num_source,) nodes, increasing
+    dist: np.ndarray  # (num_source, num_nodes) memory mapped, unreachable is the largest value of the dtype
+
+    def __init__(self, key: str, source: np.ndarray, dist: np.ndarray):
+        super(DistanceOracle, self).__init__()
+        self.key = key
+        self.source = source
+        self.dist = dist
+
+    def __contains__(self, idx: int) -> bool:
+        i = np.searchsorted(self.source, idx)
+        return i < len(self.source) and self.source[i] == idx
+
+    def row(self, idx: int) -> np.ndarray:
+        '''
+        :return: float distance from source idx to every node, inf if unreachable
+        '''
+        stored = self.dist[np.searchsorted(self.source, idx)]
+        dist = stored.astype(float)
+        dist[stored == np.iinfo(stored.dtype).max] = np.inf
+        return dist
+
+
+def layout_key(free: np.ndarray) -> str:
+    mask = np.ascontiguousarray(free, dtype=bool)
+    return hashlib.sha256(np.array(mask.shape, dtype=np.int64).tobytes() + np.packbits(mask).tobytes()).hexdigest()
+
+
+def build(grid: Grid, directory: str, source: Optional[np.ndarray] = None, max_nodes: int = 1 << 14,
+          batch_size: int = 256) -> DistanceOracle:
+    '''
+    search from every source and store the distances under directory/<layout key>, rows are written batch by batch so
+    that the table never sits in memory, the directory appears at once when it is complete
+    :param grid: grid of the layout
+    :param directory: root of the oracles of all layouts
+    :param source: nodes to store, every node if None, which needs at most max_nodes nodes
+    :param max_nodes: bound of an all pairs table, 1 << 14 nodes take 512 MiB
+    :param batch_size: sources searched at once
+    :return: the oracle, memory mapped
+    '''
+    if source is None:
+        if grid.num_nodes > max_nodes:
+            raise ValueError(f"all pairs of {grid.num_nodes} nodes exceed {max_nodes} nodes, pass the sources")
+        source = np.arange(grid.num_nodes)
+    source = np.unique(np.asarray(source, dtype=int))
+    key = layout_key(grid.free)
+    os.makedirs(directory, exist_ok=True)
+    staging = tempfile.mkdtemp(dir=directory)
+    try:
+        # distances never exceed the number of nodes
+        dtype = np.uint16 if grid.num_nodes < np.iinfo(np.uint16).max else np.uint32
+        dist = np.lib.format.open_memmap(os.path.join(staging, "dist.npy"), mode="w+", dtype=dtype,
+                                         shape=(len(source), grid.num_nodes))
+        for begin in range(0, len(source), batch_size):
+            batch_dist, _ = grid_shortest_path(grid, source[begin:begin + batch_size])
+            batch_dist[~np.isfinite(batch_dist)] = np.iinfo(dtype).max
+            dist[begin:begin + len(batch_dist)] = batch_dist
+        dist.flush()
+        del dist
+        np.save(os.path.join(staging, "source.npy"), source)
+        np.save(os.path.join(staging, "free.npy"), grid.free)
+        try:
+            os.rename(staging, os.path.join(directory, key))
+        except OSError:  # another process stored the layout first
+            pass
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    return load(grid, directory)
+
+
+def load(grid: Grid, directory: str) -> Optional[DistanceOracle]:
+    '''
+    :return: the oracle of the layout of grid stored under directory, None if there is none
+    '''
+    key = layout_key(grid.free)
+    path = os.path.join(directory, key)
+    if not os.path.isdir(path):
+        return None
+    if not np.array_equal(np.load(os.path.join(path, "free.npy")), grid.free):  # hash collision
+        return None
+    return DistanceOracle(
+        key=key,
+        source=np.load(os.path.join(path, "source.npy")),
+        dist=np.load(os.path.join(path, "dist.npy"), mmap_mode="r"),
+    )
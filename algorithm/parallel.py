@@ -0,0 +1,144 @@
+import multiprocessing
+import multiprocessing.pool
+import os
+import weakref
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import List, Tuple, Dict, Optional
+
+import numpy as np
+
+from algorithm.grid import Grid, grid_batch, search_batch, grid_shortest_path
+
+# worker state: shared blocks attached so far and the grid of the last graph
+_block: Dict[str, SharedMemory] = {}
+_grid: Tuple[Optional[str], Optional[Grid]] = (None, None)
+
+
+def _attach(name: str) -> SharedMemory:
+    # the workers share the resource tracker of the parent, the block is unlinked once by the parent
+    if name not in _block:
+        _block[name] = SharedMemory(name=name)
+    return _block[name]
+
+
+def _detach(keep: List[str]):
+    for name in [name for name in _block if name not in keep]:
+        _block.pop(name).close()
+
+
+def _search(graph_name: str, shape: Tuple[int, int], output_name: Tuple[str, str, str], capacity: int, begin: int,
+            end: int, wavefront: bool):
+    global _grid
+    if _grid[0] != graph_name:
+        free = np.ndarray(shape=shape, dtype=bool, buffer=_attach(graph_name).buf)
+        _grid = graph_name, Grid(free.copy())
+    grid = _grid[1]
+    source_name, dist_name, predecessor_name = output_name
+    _detach([graph_name, *output_name])
+    source = np.ndarray(shape=(capacity,), dtype=int, buffer=_attach(source_name).buf)
+    dist = np.ndarray(shape=(capacity, grid.num_nodes), dtype=float, buffer=_attach(dist_name).buf)
+    predecessor = np.ndarray(shape=(capacity, grid.num_nodes), dtype=np.int32, buffer=_attach(predecessor_name).buf)
+    search_batch(grid, source[begin:end], dist[begin:end], predecessor[begin:end], wavefront)
+
+
+class ParallelSearch(object):
+    '''
+    grid_shortest_path over a persistent pool of processes
+    the obstacle mask of a grid is published once in shared memory, every worker builds the grid from it once, the
+    sources and the output rows are shared blocks too, so a task is a few names and numbers
+    every batch of grid_shortest_path is split among the workers with the method it would use serially, so the
+    results are the same
+    '''
+    processes: int
+    min_source: int  # fewer sources are searched in the calling process
+    pool: multiprocessing.pool.Pool
+    graph: "weakref.WeakKeyDictionary[Grid, SharedMemory]"
+    output: Optional[Tuple[SharedMemory, SharedMemory, SharedMemory]]  # sources, dist rows, predecessor rows
+    capacity: int  # rows of the output blocks
+    num_nodes: int  # columns of the output blocks
+
+    def __init__(self, processes: Optional[int] = None, min_source: int = 64):
+        super(ParallelSearch, self).__init__()
+        self.processes = os.cpu_count() if processes is None else processes
+        self.min_source = min_source
+        # forked workers inherit a running tracker, otherwise each would start one that unlinks the blocks it saw
+        resource_tracker.ensure_running()
+        self.pool = multiprocessing.Pool(self.processes)
+        self.graph = weakref.WeakKeyDictionary()
+        self.output = None
+        self.capacity = 0
+        self.num_nodes = 0
+
+    def __call__(self, grid: Grid, indices: List[int], batch_cells: int = 1 << 22) -> Tuple[np.ndarray, np.ndarray]:
+        '''
+        see algorithm.grid.grid_shortest_path, the rows are views of shared memory that the next call overwrites
+        '''
+        indices = np.asarray(indices, dtype=int).reshape(-1)
+        if len(indices) < self.min_source:
+            return grid_shortest_path(grid, indices, batch_cells)
+        if grid not in self.graph:
+            self.graph[grid] = self.__share(grid.free)
+            weakref.finalize(grid, _unlink, self.graph[grid])
+        self.__reserve(len(indices), grid.num_nodes)
+        source, dist, predecessor = self.__view()
+        source[:len(indices)] = indices
+        task_list = []
+        for begin, end, wavefront in grid_batch(grid, len(indices), batch_cells):
+            # pieces of whole bitset words, one per worker
+            piece = 64 * -(-(end - begin) // (64 * self.processes))
+            for piece_begin in range(begin, end, piece):
+                task_list.append((
+                    self.graph[grid].name, grid.shape, tuple(block.name for block in self.output), self.capacity,
+                    piece_begin, min(piece_begin + piece, end), wavefront,
+                ))
+        self.pool.starmap(_search, task_list, chunksize=1)
+        return dist[:len(indices)], predecessor[:len(indices)]
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+        for block in list(self.graph.values()):
+            _unlink(block)
+        self.graph.clear()
+        if self.output is not None:
+            for block in self.output:
+                _unlink(block)
+            self.output = None
+
+    def __share(self, array: np.ndarray) -> SharedMemory:
+        block = SharedMemory(create=True, size=max(1, array.nbytes))
+        np.ndarray(shape=array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+        return block
+
+    def __reserve(self, num_source: int, num_nodes: int):
+        # the output blocks grow by doubling and are reused by later calls
+        if self.output is not None and num_source <= self.capacity and num_nodes == self.num_nodes:
+            return
+        if self.output is not None:
+            for block in self.output:
+                _unlink(block)
+        self.capacity = max(num_source, 2 * self.capacity if num_nodes == self.num_nodes else 0)
+        self.num_nodes = num_nodes
+        self.output = (
+            SharedMemory(create=True, size=max(1, self.capacity * np.dtype(int).itemsize)),
+            SharedMemory(create=True, size=max(1, self.capacity * num_nodes * np.dtype(float).itemsize)),
+            SharedMemory(create=True, size=max(1, self.capacity * num_nodes * np.dtype(np.int32).itemsize)),
+        )
+
+    def __view(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        source_block, dist_block, predecessor_block = self.output
+        return (
+            np.ndarray(shape=(self.capacity,), dtype=int, buffer=source_block.buf),
+            np.ndarray(shape=(self.capacity, self.num_nodes), dtype=float, buffer=dist_block.buf),
+            np.ndarray(shape=(self.capacity, self.num_nodes), dtype=np.int32, buffer=predecessor_block.buf),
+        )
+
+
+def _unlink(block: SharedMemory):
+    # rows handed out may still be alive, the memory goes with the last of them
+    try:
+        block.unlink()
+        block.close()
+    except (FileNotFoundError, BufferError):
+        pass
@@ -0,0 +1,159 @@
+import functools
+import json
+import os
+import time
+from typing import List, Dict, Tuple, Callable, TypeVar, Optional
+
+# phase, start (perf_counter seconds), duration (seconds), process
+Event = Tuple[str, float, float, int]
+
+F = TypeVar("F", bound=Callable)
+
+_enabled: bool = False
+_event: List[Event] = []
+_stat: Dict[str, List[float]] = {}  # phase -> [count, total seconds, max seconds]
+
+
+def enable():
+    '''
+    start recording phases, nothing is recorded by default
+    '''
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def reset():
+    _event.clear()
+    _stat.clear()
+
+
+def record(name: str, start: float, duration: float, pid: Optional[int] = None):
+    if pid is None:
+        pid = os.getpid()
+    _event.append((name, start, duration, pid))
+    stat = _stat.get(name)
+    if stat is None:
+        _stat[name] = [1, duration, duration]
+    else:
+        stat[0] += 1
+        stat[1] += duration
+        stat[2] = max(stat[2], duration)
+
+
+class _Span(object):
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        record(self.name, self.start, time.perf_counter() - self.start)
+
+
+class _NullSpan(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name: str):
+    '''
+    time a block, with span(name): ...
+    a disabled span is a shared object that does nothing
+    '''
+    return _Span(name) if _enabled else _NULL_SPAN
+
+
+def traced(name: str) -> Callable[[F], F]:
+    '''
+    time every call of a function, a disabled trace costs one flag check per call
+    '''
+
+    def decorator(f: F) -> F:
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return f(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                record(name, start, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+def drain() -> List[Event]:
+    '''
+    take the events recorded so far, so that a worker process can send them back with its result
+    '''
+    event_list = list(_event)
+    _event.clear()
+    return event_list
+
+
+def merge(event_list: List[Event]):
+    '''
+    record the events of another process, perf_counter is system wide on linux so the timelines line up
+    '''
+    for event in event_list:
+        record(*event)
+
+
+def stat() -> Dict[str, Tuple[int, float, float]]:
+    '''
+    :return: phase -> (count, total seconds, max seconds)
+    '''
+    return {name: (int(count), total, maximum) for name, (count, total, maximum) in _stat.items()}
+
+
+def summary() -> str:
+    '''
+    :return: one line per phase, the most expensive first
+    '''
+    line_list = [f"{'phase':>24} | {'count':>7} | {'total_ms':>10} | {'mean_ms':>9} | {'max_ms':>9}"]
+    for name, (count, total, maximum) in sorted(stat().items(), key=lambda item: -item[1][1]):
+        line_list.append(
+            f"{name:>24} | {count:>7} | {1000 * total:>10.1f} | {1000 * total / count:>9.3f} | {1000 * maximum:>9.3f}"
+        )
+    return "\n".join(line_list)
+
+
+def dump(path: str):
+    '''
+    write the events, chrome trace format (chrome://tracing, perfetto) if path ends with .json, json lines otherwise
+    '''
+    with open(path, "w") as f:
+        if path.endswith(".json"):
+            json.dump({
+                "displayTimeUnit": "ms",
+                "traceEvents": [
+                    {"name": name, "ph": "X", "ts": 1e6 * start, "dur": 1e6 * duration, "pid": pid, "tid": pid}
+                    for name, start, duration, pid in _event
+                ],
+            }, f)
+        else:
+            for name, start, duration, pid in _event:
+                f.write(json.dumps({"phase": name, "start_s": start, "duration_s": duration, "pid": pid}) + "\n")
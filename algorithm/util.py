@@ -1,24 +1,32 @@
-from typing import List, Dict, Tuple, Set
+from typing import List, Dict, Tuple, Set, Iterator, Optional
 
 import numpy as np
 import scipy as sp
 import scipy.optimize
 import scipy.sparse
-from sklearn.cluster import SpectralClustering, AffinityPropagation
+import scipy.sparse.csgraph
 
+from algorithm import trace
+from algorithm.grid import Graph, Grid
+from algorithm.hpa import HierarchicalGrid, HierarchicalField
 
-def shortest_path(adj: np.ndarray, indices: List[int]) -> Tuple[Dict[int, np.ndarray], Dict[int, np.ndarray]]:
+
+@trace.traced("shortest_path")
+def shortest_path(graph: Graph, indices: List[int]) -> Tuple[Dict[int, np.ndarray], Dict[int, np.ndarray]]:
     '''
-    shortest path algorithm
-    :param adj: adjacency matrix
+    shortest path algorithm, cached breadth-first search on grids, lazy fields on hierarchical grids (see
+    algorithm.hpa), Dijkstra otherwise
+    :param graph: grid, hierarchical grid or sparse adjacency matrix
     :param indices: indices of nodes used to calculate distances
     :return dist: dist[i][j]: distance from node (i) to node (j) (i: row, j col)
     :return predecessor:    predecessor[j][i] : first node to move from node (i) to node (j) (i: row, j: col)
                             if predecessor[j][i] == i: two nodes are neighbour
     '''
+    if isinstance(graph, (Grid, HierarchicalGrid)):
+        return graph.shortest_path(indices)
     dist_reduced, predecessor_reduced = sp.sparse.csgraph.shortest_path(
         method="D",  # Dijkstra
-        csgraph=adj,
+        csgraph=graph,
         directed=True,
         indices=indices,
         return_predecessors=True,
@@ -33,18 +41,114 @@ def shortest_path(adj: np.ndarray, indices: List[int]) -> Tuple[Dict[int, np.nda
     return dist, predecessor
 
 
-def linear_sum_assignment(cost_matrix: np.ndarray, maximize: bool = False) -> List[Tuple[int, int]]:
+def agent_goal_distance(dist: Dict[int, np.ndarray], agent_list: List[int], goal_list: List[int]) -> np.ndarray:
+    '''
+    the graph is undirected, so the fields of the goals hold the distances from every agent
+    :param dist: dist[g][j]: distance from goal g to node j, see shortest_path
+    :return: (len(agent_list), len(goal_list)) distance from each agent to each goal, inf if unreachable
+    '''
+    with trace.span("cost_matrix"):
+        ag_dist = np.empty(shape=(len(agent_list), len(goal_list)), dtype=float)
+        for w, g in enumerate(goal_list):
+            ag_dist[:, w] = dist[g][agent_list]
+    return ag_dist
+
+
+@trace.traced("linear_sum_assignment")
+def linear_sum_assignment(cost_matrix: np.ndarray, maximize: bool = False, candidate: Optional[int] = None) -> \
+List[Tuple[int, int]]:
     '''
     see scipy.optimize.linear_sum_assignment
-    :param cost_matrix:
-    :return:
+    :param cost_matrix: inf for forbidden pairs
+    :param candidate: if set, large rectangular problems only keep the candidate cheapest pairs of each row (of each
+                      column if the matrix is tall) and are solved as a sparse matching, the result is optimal among
+                      these pairs, the dense problem is solved if they do not admit a full matching
+    :return: the most pairs without forbidden ones (e.g. goals no agent reaches), then the least cost among them
     '''
+    if candidate is not None and not maximize:
+        assignment = _sparse_linear_sum_assignment(cost_matrix, candidate)
+        if assignment is not None:
+            return assignment
+    allowed = np.isfinite(cost_matrix)
+    if not maximize and not allowed.all():
+        cost_matrix = penalize_forbidden(cost_matrix)
     row, col = sp.optimize.linear_sum_assignment(cost_matrix=cost_matrix, maximize=maximize)
-    assignment: List[Tuple[int, int]] = [(row[i], col[i]) for i in range(len(row))]
+    assignment: List[Tuple[int, int]] = [(row[i], col[i]) for i in range(len(row)) if allowed[row[i], col[i]]]
     return assignment
 
 
+def penalize_forbidden(cost_matrix: np.ndarray) -> np.ndarray:
+    '''
+    :param cost_matrix: inf for forbidden pairs
+    :return: forbidden pairs cost more than any assignment of allowed pairs, so a minimal assignment has the most
+             allowed pairs, drop the forbidden ones from it
+    '''
+    finite = np.isfinite(cost_matrix)
+    largest = np.abs(cost_matrix[finite]).max(initial=0.0)
+    penalty = (min(cost_matrix.shape) + 1) * (2 * largest + 1.0)
+    return np.where(finite, cost_matrix, penalty)
+
+
+def _sparse_linear_sum_assignment(cost_matrix: np.ndarray, candidate: int, min_row: int = 1000,
+                                  min_ratio: float = 1.25) -> Optional[List[Tuple[int, int]]]:
+    # the sparse solver beats the dense one from about a thousand rows, provided the long side leaves alternatives:
+    # on square problems the candidates barely admit a full matching and it can be much slower
+    transpose = cost_matrix.shape[0] > cost_matrix.shape[1]
+    cost = cost_matrix.T if transpose else cost_matrix
+    num_row, num_col = cost.shape
+    if num_row < min_row or num_col < min_ratio * num_row or candidate >= num_col:
+        return None
+    col = np.argpartition(cost, candidate, axis=1)[:, :candidate].reshape(-1)
+    row = np.repeat(np.arange(num_row), candidate)
+    weight = cost[row, col]
+    finite = np.isfinite(weight)
+    # explicit zeros are not edges, every row is matched once so a constant shift keeps the optimum
+    biadjacency = sp.sparse.csr_matrix((weight[finite] + 1.0, (row[finite], col[finite])), shape=cost.shape)
+    try:
+        row, col = sp.sparse.csgraph.min_weight_full_bipartite_matching(biadjacency)
+    except ValueError:  # no full matching among the candidates
+        return None
+    if transpose:
+        row, col = col, row
+    order = np.argsort(row)
+    return [(row[i], col[i]) for i in order]
+
+
+def bottleneck_assignment(cost_matrix: np.ndarray) -> List[Tuple[int, int]]:
+    '''
+    assignment of maximal size that minimizes the largest cost, ties are broken by the least sum of costs
+    :param cost_matrix: inf for forbidden pairs
+    :return: same as linear_sum_assignment, rows or columns without any finite cost stay unassigned
+    '''
+    finite = np.isfinite(cost_matrix)
+    if not finite.any():
+        return []
+    value = np.unique(cost_matrix[finite])
+
+    def matching_size(threshold: float) -> int:
+        biadjacency = sp.sparse.csr_matrix(finite & (cost_matrix <= threshold))
+        return int(np.count_nonzero(sp.sparse.csgraph.maximum_bipartite_matching(biadjacency, perm_type="column") >= 0))
+
+    # binary search of the least threshold that keeps the largest matching
+    size = matching_size(value[-1])
+    lo, hi = 0, len(value) - 1
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if matching_size(value[mid]) == size:
+            hi = mid
+        else:
+            lo = mid + 1
+    allowed = finite & (cost_matrix <= value[lo])
+    # least sum among the matchings under the threshold, pairs above it cost more than any matching under it
+    penalty = (size + 1) * value[lo] + 1.0
+    cost = np.where(allowed, cost_matrix, penalty)
+    return [(i, j) for i, j in linear_sum_assignment(cost) if allowed[i, j]]
+
+
+@trace.traced("graph_partitioning")
 def graph_partitioning(adj: np.ndarray, k: int = 2) -> List[List[int]]:
+    # sklearn takes a second to import, only pay for it when partitioning this way
+    from sklearn.cluster import SpectralClustering, AffinityPropagation
     # clustering = SpectralClustering(n_clusters=k, affinity="precomputed", random_state=None).fit(adj)
     clustering = AffinityPropagation(affinity="precomputed", random_state=None).fit(adj)
     label = list(clustering.labels_)
@@ -58,22 +162,100 @@ def graph_partitioning(adj: np.ndarray, k: int = 2) -> List[List[int]]:
     return comm_list
 
 
+@trace.traced("geodesic_k_medoids")
+def geodesic_k_medoids(dist: Dict[int, np.ndarray], goal_list: List[int], seed_list: List[int], max_iter: int = 20,
+                       max_candidate: int = 64) -> List[List[int]]:
+    '''
+    k-medoids on shortest path distances between goals, k = len(seed_list), cluster sizes are not balanced
+    the medoids start at distinct goals closest to the seeds, every goal joins its nearest medoid, then every medoid
+    moves to the member with the least total distance to the cluster among the max_candidate members closest to it
+    memory is O(k x goals), no goals x goals matrix is built
+    :param dist: dist[g][j]: distance from goal g to node j
+    :param goal_list: goals, at least k
+    :param seed_list: nodes the clusters grow from, e.g. agents
+    :param max_iter: upper bound of medoid updates
+    :param max_candidate: members tried as new medoid of a cluster
+    :return: exactly k non-empty clusters of indices into goal_list
+    '''
+    goal = np.asarray(goal_list, dtype=int)
+    k = len(seed_list)
+    # distinct goals closest to the seeds
+    seed_goal_dist = np.stack([dist[g][seed_list] for g in goal_list], axis=1)
+    _, medoid = sp.optimize.linear_sum_assignment(_finite(seed_goal_dist))
+
+    def nearest_medoid(medoid: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        medoid_goal_dist = _finite(np.stack([dist[goal_list[m]][goal] for m in medoid]))
+        label = np.argmin(medoid_goal_dist, axis=0)
+        label[medoid] = np.arange(k)  # a medoid stays in its own cluster, so that no cluster is empty
+        return label, medoid_goal_dist
+
+    label, medoid_goal_dist = nearest_medoid(medoid)
+    for _ in range(max_iter):
+        new_medoid = medoid.copy()
+        for c, member in enumerate(_group(label, k)):
+            candidate = member[np.argsort(medoid_goal_dist[c, member])[:max_candidate]]
+            cost = [_finite(dist[goal_list[m]][goal[member]]).sum() for m in candidate]
+            new_medoid[c] = candidate[np.argmin(cost)]
+        if (new_medoid == medoid).all():
+            break
+        medoid = new_medoid
+        label, medoid_goal_dist = nearest_medoid(medoid)
+    return [member.tolist() for member in _group(label, k)]
+
+
+def _group(label: np.ndarray, k: int) -> List[np.ndarray]:
+    # indices of each label, in increasing order
+    order = np.argsort(label, kind="stable")
+    return np.split(order, np.cumsum(np.bincount(label, minlength=k))[:-1])
+
+
+def _finite(dist: np.ndarray) -> np.ndarray:
+    # unreachable pairs cost more than any path
+    return np.where(np.isfinite(dist), dist, 1e12)
+
+
+class Plan(list):
+    '''
+    path of each agent, as returned by an auto controller, with the goal node each agent heads to, -1 if it has none
+    a path may stop short of its goal (one stretch on hierarchical fields), the paths of a plain list end at their goal
+    '''
+    goal: List[int]
+
+    def __init__(self, path_list: List[np.ndarray], goal: List[int]):
+        super(Plan, self).__init__(path_list)
+        self.goal = goal
+
+
+@trace.traced("assignment_to_path")
 def assignment_to_path(agent_list: List[int], predecessor: Dict[int, np.ndarray], assignment: List[Tuple[int, int]]) -> \
-List[List[int]]:
-    agent2goal: Dict[int, int] = {}
+Plan:
+    '''
+    :return: path of each agent as int32 nodes, starting at the agent, only the agent itself if it has no goal
+             on hierarchical fields only the next stretch of the path
+    '''
+    # salesmen on the same cell share a node, each of them takes the next of its goals
+    agent2goal: Dict[int, List[int]] = {}
     for a, g in assignment:
-        agent2goal[a] = g
+        agent2goal.setdefault(a, []).append(g)
     # find next position of agents
-    next_agent_path: List[List[int]] = [[a] for a in agent_list]
-    for i, a in enumerate(agent_list):
-        g = agent2goal.get(a, None)
+    next_agent_path: List[np.ndarray] = []
+    goal_list: List[int] = []
+    for a in agent_list:
+        g = agent2goal[a].pop(0) if len(agent2goal.get(a, [])) > 0 else None
+        goal_list.append(-1 if g is None else int(g))
         if g is None:  # agent does not need to move
+            next_agent_path.append(np.array([a], dtype=np.int32))
             continue
-        current_a = a
-        while True:
-            next_a = predecessor[g][current_a]
-            if next_a == -9999:  # goal found
-                break
-            next_agent_path[i].append(next_a)
-            current_a = next_a
-    return next_agent_path
+        field = predecessor[g]
+        if isinstance(field, HierarchicalField):
+            next_agent_path.append(np.array(field.walk(a), dtype=np.int32))
+        else:
+            next_agent_path.append(np.fromiter(_walk(field, a), dtype=np.int32))
+    return Plan(next_agent_path, goal_list)
+
+
+def _walk(predecessor: np.ndarray, a: int) -> Iterator[int]:
+    current_a = a
+    while current_a != -9999:  # goal found
+        yield current_a
+        current_a = predecessor[current_a]
@@ -0,0 +1,254 @@
+import argparse
+import json
+import multiprocessing
+import platform
+import queue
+import subprocess
+import time
+import tracemalloc
+from typing import List, Tuple, Dict, Any, Callable, NamedTuple, Optional
+
+import numpy as np
+import scipy
+
+from algorithm import util
+from algorithm.hpa import HierarchicalGrid
+from algorithm.msoc import minimal_sum_of_costs_controller
+from board.board import Board
+from simulation.simulator import simulate
+
+
+class Case(NamedTuple):
+    shape: Tuple[int, int]
+    obstacle: float  # fraction of cells
+    customer: float  # fraction of cells
+    salesman: float  # fraction of cells
+
+    @property
+    def name(self) -> str:
+        return f"{self.shape[0]}x{self.shape[1]}/o{self.obstacle}/c{self.customer}/s{self.salesman}"
+
+    def count(self) -> Tuple[int, int, int]:
+        size = self.shape[0] * self.shape[1]
+        return int(self.obstacle * size), max(1, int(self.customer * size)), max(1, int(self.salesman * size))
+
+
+SHAPE_LIST = [(15, 20), (45, 60), (100, 100), (300, 300), (1000, 1000)]
+DENSITY_LIST = [(0.05, 0.01), (0.01, 0.002)]  # customer, salesman
+
+
+def measure(fn: Callable[[], Any], repeat: int) -> Tuple[Dict[str, Any], Any]:
+    '''
+    :return: best wall time of repeat runs and peak traced memory of one more run, result of the last run
+    '''
+    wall_list = []
+    output = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        output = fn()
+        wall_list.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"wall_s": min(wall_list), "peak_bytes": peak}, output
+
+
+def sample_board(case: Case, seed: int) -> Tuple[List[Tuple[int, int]], List[Tuple[int, int]], List[Tuple[int, int]]]:
+    # disjoint obstacle, customer and salesman cells
+    num_obstacle, num_customer, num_salesman = case.count()
+    rng = np.random.default_rng(seed)
+    cell = rng.choice(case.shape[0] * case.shape[1], size=num_obstacle + num_customer + num_salesman, replace=False)
+    coord = [(int(h), int(w)) for h, w in zip(*np.unravel_index(cell, case.shape))]
+    return (
+        coord[:num_obstacle],
+        coord[num_obstacle:num_obstacle + num_customer],
+        coord[num_obstacle + num_customer:],
+    )
+
+
+def run_hierarchy(board: Board, agent_list: List[int], goal_list: List[int], repeat: int,
+                  emit: Callable[[str, Dict[str, Any]], None]):
+    '''
+    build the hierarchy of the board and plan on it, it is freed on return
+    '''
+    result, hierarchy = measure(lambda: HierarchicalGrid(board.graph), repeat)
+    emit("hierarchy_build", result)
+
+    def hierarchy_plan_cold():
+        hierarchy.goal_cache.clear()
+        return minimal_sum_of_costs_controller(hierarchy, agent_list, goal_list)
+
+    result, _ = measure(hierarchy_plan_cold, repeat)
+    emit("hierarchy_plan", result)
+    result, _ = measure(lambda: minimal_sum_of_costs_controller(hierarchy, agent_list, goal_list), repeat)
+    emit("hierarchy_plan_cached", result)
+
+
+def run_case(case: Case, seed: int, repeat: int, max_field_cells: int, max_episode_cells: int,
+             emit: Callable[[str, Dict[str, Any]], None]):
+    '''
+    run the phases of a case from cheap to expensive, emit(phase, result) after each one
+    '''
+    obstacle_list, customer_list, salesman_list = sample_board(case, seed)
+
+    def new_board() -> Board:
+        return Board(case.shape, list(obstacle_list), list(customer_list), list(salesman_list))
+
+    result, _ = measure(lambda: Board._Board__create_graph(case.shape, obstacle_list), repeat)
+    emit("create_graph", result)
+    result, board = measure(new_board, repeat)
+    emit("board", result)
+
+    agent_list = [board.graph.coord2index[coord] for coord in board.view()[2]]
+    goal_list = [board.graph.coord2index[coord] for coord in board.view()[1]]
+
+    # the hierarchical grid never holds a field over the whole grid, it runs on every size
+    run_hierarchy(board, agent_list, goal_list, repeat, emit)
+
+    if len(goal_list) * board.graph.num_nodes > max_field_cells:
+        for phase in ["shortest_path", "shortest_path_cached", "cost_matrix", "linear_sum_assignment",
+                      "sparse_linear_sum_assignment", "graph_partitioning", "geodesic_k_medoids",
+                      "assignment_to_path", "control_auto", "episode"]:
+            emit(phase, {"status": "skipped"})
+        return
+
+    def shortest_path_cold():
+        board.graph.cache.clear()
+        return util.shortest_path(board.graph, goal_list)
+
+    result, (dist, predecessor) = measure(shortest_path_cold, repeat)
+    emit("shortest_path", result)
+    result, _ = measure(lambda: util.shortest_path(board.graph, goal_list), repeat)
+    emit("shortest_path_cached", result)
+
+    result, ag_dist_adj = measure(lambda: util.agent_goal_distance(dist, agent_list, goal_list), repeat)
+    emit("cost_matrix", result)
+    result, assignment_reduced = measure(lambda: util.linear_sum_assignment(ag_dist_adj), repeat)
+    emit("linear_sum_assignment", result)
+    result, _ = measure(lambda: util.linear_sum_assignment(ag_dist_adj, candidate=16), repeat)
+    emit("sparse_linear_sum_assignment", result)
+
+    if len(agent_list) < len(goal_list) <= 2000:
+        goal_dist = np.array([dist[g][goal_list] for g in goal_list])
+        inv_goal_dist = 1 / np.maximum(goal_dist, 1.0)
+        result, _ = measure(lambda: util.graph_partitioning(inv_goal_dist, k=len(agent_list)), repeat)
+        emit("graph_partitioning", result)
+    else:
+        emit("graph_partitioning", {"status": "skipped"})
+    if len(agent_list) <= len(goal_list):
+        result, _ = measure(lambda: util.geodesic_k_medoids(dist, goal_list, agent_list), repeat)
+        emit("geodesic_k_medoids", result)
+    else:
+        emit("geodesic_k_medoids", {"status": "skipped"})
+
+    assignment = [(agent_list[h], goal_list[w]) for h, w in assignment_reduced]
+    result, _ = measure(lambda: util.assignment_to_path(agent_list, predecessor, assignment), repeat)
+    emit("assignment_to_path", result)
+
+    def control_auto():
+        tick_board = new_board()
+        t0 = time.perf_counter()
+        tick_board.control_auto(minimal_sum_of_costs_controller)
+        return time.perf_counter() - t0
+
+    # board construction is excluded from the wall time, not from the peak memory
+    wall_list = [control_auto() for _ in range(repeat)]
+    tracemalloc.start()
+    control_auto()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    emit("control_auto", {"wall_s": min(wall_list), "peak_bytes": peak})
+
+    if case.shape[0] * case.shape[1] > max_episode_cells:
+        emit("episode", {"status": "skipped"})
+        return
+    t0 = time.perf_counter()
+    episode = simulate(new_board(), minimal_sum_of_costs_controller)
+    emit("episode", {
+        "wall_s": time.perf_counter() - t0,
+        "steps": episode.num_steps,
+        "finished": episode.finished,
+        "replans": episode.num_replans,
+        "planning_s": episode.planning_time,
+    })
+
+
+def _case_worker(case: Case, seed: int, repeat: int, max_field_cells: int, max_episode_cells: int,
+                 channel: multiprocessing.Queue):
+    run_case(case, seed, repeat, max_field_cells, max_episode_cells, lambda phase, result: channel.put((phase, result)))
+    channel.put(None)
+
+
+def run(case_list: List[Case], seed: int = 1234, repeat: int = 3, timeout: float = 600.0,
+        max_field_cells: int = 1 << 27, max_episode_cells: int = 100_000) -> List[Dict[str, Any]]:
+    '''
+    run every case in a fresh process, so that peak memory and imports do not leak between cases
+    a case that exceeds timeout keeps its finished phases, the running phase is reported as timeout
+    '''
+    context = multiprocessing.get_context("spawn")
+    record_list: List[Dict[str, Any]] = []
+    for case in case_list:
+        channel = context.Queue()
+        process = context.Process(
+            target=_case_worker, args=(case, seed, repeat, max_field_cells, max_episode_cells, channel),
+        )
+        process.start()
+        deadline = time.perf_counter() + timeout
+        status = "ok"
+        while True:
+            try:
+                item = channel.get(timeout=max(0.0, deadline - time.perf_counter()))
+            except queue.Empty:
+                status = "timeout" if process.is_alive() else "crashed"
+                break
+            if item is None:
+                break
+            phase, result = item
+            record_list.append({"case": case.name, "shape": list(case.shape), "phase": phase, "status": "ok",
+                                **result})
+            print(json.dumps(record_list[-1]), flush=True)
+        if status != "ok":
+            process.terminate()
+            record_list.append({"case": case.name, "shape": list(case.shape), "status": status})
+            print(json.dumps(record_list[-1]), flush=True)
+        process.join()
+    return record_list
+
+
+def meta() -> Dict[str, Optional[str]]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "commit": commit,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "scipy": scipy.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="time and trace memory of each planning phase across board sizes")
+    parser.add_argument("--shape", type=int, nargs=2, action="append", help="repeatable, default: 15x20 to 1000x1000")
+    parser.add_argument("--obstacle", type=float, default=0.1)
+    parser.add_argument("--density", type=float, nargs=2, action="append", metavar=("CUSTOMER", "SALESMAN"),
+                        help="repeatable, default: 0.05 0.01 and 0.01 0.002")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=600.0, help="seconds per case")
+    parser.add_argument("--output", type=str, default="benchmark.json")
+    args = parser.parse_args()
+
+    case_list = [
+        Case(tuple(shape), args.obstacle, customer, salesman)
+        for shape in (args.shape or SHAPE_LIST)
+        for customer, salesman in (args.density or DENSITY_LIST)
+    ]
+    record_list = run(case_list, seed=args.seed, repeat=args.repeat, timeout=args.timeout)
+    with open(args.output, "w") as f:
+        json.dump({"meta": meta(), "results": record_list}, f, indent=1)
@@ -0,0 +1,30 @@
+import argparse
+import json
+from typing import Dict, Tuple, Any
+
+
+def load(path: str) -> Dict[Tuple[str, str], Dict[str, Any]]:
+    with open(path) as f:
+        data = json.load(f)
+    return {(r["case"], r.get("phase", "")): r for r in data["results"]}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="compare two benchmark.json files phase by phase")
+    parser.add_argument("base", type=str)
+    parser.add_argument("head", type=str)
+    parser.add_argument("--threshold", type=float, default=1.2, help="flag phases slower than base by this factor")
+    args = parser.parse_args()
+
+    base, head = load(args.base), load(args.head)
+    print(f"{'case':<36} {'phase':<22} {'base_s':>10} {'head_s':>10} {'ratio':>7} {'base_MB':>9} {'head_MB':>9}")
+    for key in [*base.keys(), *[k for k in head.keys() if k not in base]]:
+        b, h = base.get(key, {}), head.get(key, {})
+        if "wall_s" not in b and "wall_s" not in h:
+            print(f"{key[0]:<36} {key[1]:<22} {b.get('status', '-'):>10} {h.get('status', '-'):>10}")
+            continue
+        b_s, h_s = b.get("wall_s", float("nan")), h.get("wall_s", float("nan"))
+        b_mb, h_mb = b.get("peak_bytes", float("nan")) / 2 ** 20, h.get("peak_bytes", float("nan")) / 2 ** 20
+        ratio = h_s / b_s if b_s > 0 else float("nan")
+        flag = "  <-- slower" if ratio > args.threshold else ""
+        print(f"{key[0]:<36} {key[1]:<22} {b_s:>10.4f} {h_s:>10.4f} {ratio:>7.2f} {b_mb:>9.1f} {h_mb:>9.1f}{flag}")
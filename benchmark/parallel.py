@@ -0,0 +1,49 @@
+import argparse
+import os
+import time
+
+import numpy as np
+
+from algorithm.grid import grid_shortest_path
+from algorithm.parallel import ParallelSearch
+from benchmark.benchmark import Case, sample_board
+from board.board import Board
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="time shared memory searches from many sources against core count")
+    parser.add_argument("--shape", type=int, nargs=2, default=[300, 300])
+    parser.add_argument("--obstacle", type=float, default=0.1)
+    parser.add_argument("--source", type=int, default=1024, help="number of sources searched at once")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--processes", type=int, nargs="+", default=None, help="default: 1 to the number of cores")
+    args = parser.parse_args()
+
+    case = Case(tuple(args.shape), args.obstacle, 0.0, 0.0)
+    obstacle_list, _, _ = sample_board(case, args.seed)
+    grid = Board(case.shape, obstacle_list, [], []).graph
+    rng = np.random.default_rng(args.seed)
+    source = rng.choice(grid.num_nodes, size=min(args.source, grid.num_nodes), replace=False)
+
+    def best(fn) -> float:
+        wall_list = []
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            fn()
+            wall_list.append(time.perf_counter() - t0)
+        return min(wall_list)
+
+    serial_dist, serial_predecessor = grid_shortest_path(grid, source)
+    serial_s = best(lambda: grid_shortest_path(grid, source))
+    print(f"{case.name} sources={len(source)} cores={os.cpu_count()}")
+    print(f"{'processes':>9} {'wall_s':>10} {'speedup':>8} {'equal':>6}")
+    print(f"{'serial':>9} {serial_s:>10.4f} {1.0:>8.2f} {'-':>6}")
+    for processes in (args.processes or range(1, os.cpu_count() + 1)):
+        search = ParallelSearch(processes)
+        try:
+            dist, predecessor = search(grid, source)  # publishes the grid and warms up the workers
+            equal = np.array_equal(dist, serial_dist) and np.array_equal(predecessor, serial_predecessor)
+            wall_s = best(lambda: search(grid, source))
+        finally:
+            search.close()
+        print(f"{processes:>9} {wall_s:>10.4f} {serial_s / wall_s:>8.2f} {str(equal):>6}")
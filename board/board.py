@@ -1,24 +1,34 @@
-from typing import Tuple, Union, List, Dict, Optional
+from typing import Tuple, Union, List, Optional
 
 import numpy as np
+import scipy as sp
+import scipy.spatial
 
+from algorithm import trace
+from algorithm.grid import Grid
 from board.controller import AutoController, Controller
-
-Coord = Tuple[int, int]
+from board.generator import random_board, connected_component, Coord
 
 
 class Board(object):
     shape: Tuple[int, int]  # hw
-    obstacle_list: List[Coord]
-    customer_list: List[Coord]
-    salesman_list: List[Coord]
+    obstacle: np.ndarray  # (num_obstacle, 2) hw
+    customer: np.ndarray  # (num_customer, 2) hw
+    salesman: np.ndarray  # (num_salesman, 2) hw
+    salesman_id: np.ndarray  # (num_salesman,) position of each salesman among the salesmen the game started with
 
     # graph
-    adj: np.ndarray
-    index2coord: List[Tuple[int, int]]
-    coord2index: Dict[Tuple[int, int], int]
-    # controller cache
-    last_path: Optional[List[List[Tuple[int, int]]]]
+    graph: Grid  # graph.free is the obstacle layer
+    component: np.ndarray  # (h, w) connected component of each cell, see board.generator.connected_component
+    # controller cache: path i is last_path[path_offset[i]:path_offset[i] + path_length[i]], nodes from the salesman
+    # to its goal, path_cursor[i] is the position of the salesman on it
+    last_path: Optional[np.ndarray]  # int32 nodes of all paths, None if there is no plan, dispatch appends to it
+    path_offset: np.ndarray
+    path_length: np.ndarray
+    path_cursor: np.ndarray
+    path_goal: np.ndarray  # node the path leads to, it may end before (see algorithm.util.Plan), -1 if none
+    need_plan: bool  # a path is finished or the salesmen were moved by hand, the cached paths are stale
+    need_dispatch: bool  # customers arrived since the last plan, salesmen without a goal may take them
 
     def __init__(
             self,
@@ -26,138 +36,262 @@ class Board(object):
             obstacle: Union[List[Coord], int],
             customer: Union[List[Coord], int],
             salesman: Union[List[Coord], int],
+            rng: Optional[np.random.Generator] = None,
+            reachable: bool = False,
     ):
         super(Board, self).__init__()
+        if rng is None:
+            rng = np.random.default_rng()
         # shape
         self.shape = shape
-        # obstacle
-        if isinstance(obstacle, int):
-            self.obstacle_list = Board.__random_mask(shape, obstacle)
-        else:
-            self.obstacle_list = obstacle
-        # customer
-        if isinstance(customer, int):
-            self.customer_list = Board.__random_mask(shape, customer)
-        else:
-            self.customer_list = customer
-        # salesman
-        if isinstance(salesman, int):
-            self.salesman_list = Board.__random_mask(shape, salesman)
-        else:
-            self.salesman_list = salesman
+        # obstacle, customer, salesman
+        obstacle, customer, salesman = random_board(shape, obstacle, customer, salesman, rng, reachable)
+        # obstacles never move, the invalid ones are removed once
+        self.obstacle = obstacle[self.__in_range(obstacle)]
+        self.customer = customer
+        self.salesman = salesman
         # graph
-        self.adj, self.index2coord, self.coord2index = Board.__create_graph(self.shape, self.obstacle_list)
+        self.graph = Board.__create_graph(self.shape, self.obstacle)
+        self.component = connected_component(self.graph.free)
         # cache controller
         self.last_path = None
+        self.need_plan = True
+        self.need_dispatch = False
+        self.salesman_id = np.arange(len(self.salesman))
         self.__ensure_valid()
+        # the game starts with the valid salesmen
+        self.salesman_id = np.arange(len(self.salesman))
 
     def control_auto(self, controller: AutoController):
+        if self.need_plan:
+            self.set_plan(controller(*self.plan_request()))
+            self.need_dispatch = False
+        elif self.need_dispatch:
+            self.dispatch(controller)
+        self.step_plan()
+
+    def add_customer(self, customer: np.ndarray) -> np.ndarray:
+        '''
+        customers that arrive during the game, cells that are not free, already hold a customer or a salesman, or that
+        no salesman can reach are turned away
+        :param customer: (num_arrival, 2) hw
+        :return: (num_accepted, 2) hw of the customers that were added
+        '''
+        customer = Board.__as_array(customer)
+        width = self.shape[1]
+        cell = customer[:, 0] * width + customer[:, 1]
+        accept = self.__on_free(customer)
+        accept &= ~np.isin(cell, self.customer[:, 0] * width + self.customer[:, 1])
+        accept &= ~np.isin(cell, self.salesman[:, 0] * width + self.salesman[:, 1])
+        _, first = np.unique(cell, return_index=True)
+        accept &= np.isin(np.arange(len(cell)), first)
+        accept[accept] = self.reachable(customer[accept])
+        if accept.any():
+            self.customer = np.concatenate([self.customer, customer[accept]])
+            self.need_dispatch = True
+        return customer[accept]
+
+    def dispatch(self, controller: AutoController):
+        '''
+        plan for the salesmen without a goal only, toward the customers no salesman is heading to
+        the paths of the other salesmen stay as they are, the new ones are appended to last_path
+        '''
+        self.need_dispatch = False
+        if self.last_path is None:
+            self.set_plan(controller(*self.plan_request()))
+            return
+        busy = self.path_length - self.path_cursor >= 2
+        idle = np.flatnonzero(~busy)
+        # customers nobody heads to, in the component of an idle salesman
+        free_goal = ~np.isin(self.graph.coord2index[self.customer[:, 0], self.customer[:, 1]], self.path_goal[busy])
+        free_goal &= np.isin(self.component[self.customer[:, 0], self.customer[:, 1]],
+                             self.component[self.salesman[idle, 0], self.salesman[idle, 1]])
+        customer_index = self.graph.coord2index[self.customer[free_goal, 0], self.customer[free_goal, 1]]
+        if len(idle) == 0 or len(customer_index) == 0:
+            return
+        salesman_index = self.graph.coord2index[self.salesman[idle, 0], self.salesman[idle, 1]]
+        self.__append_path(idle, controller(self.graph, salesman_index.tolist(), customer_index.tolist()))
+
+    def reachable(self, coord: np.ndarray) -> np.ndarray:
+        '''
+        :param coord: (n, 2) hw of free cells
+        :return: (n,) True on the cells in a connected component that holds a salesman
+        '''
+        salesman_component = self.component[self.salesman[:, 0], self.salesman[:, 1]]
+        return np.isin(self.component[coord[:, 0], coord[:, 1]], salesman_component)
+
+    def plan_request(self) -> Tuple[Grid, List[int], List[int]]:
+        '''
+        :return: arguments of an AutoController for the current board, they do not change when the board does
+        '''
+        return (
+            self.graph,
+            self.graph.coord2index[self.salesman[:, 0], self.salesman[:, 1]].tolist(),
+            self.graph.coord2index[self.customer[:, 0], self.customer[:, 1]].tolist(),
+        )
+
+    def set_plan(self, salesman_index_path_list: List[np.ndarray]):
+        '''
+        cache the paths of a plan made from an earlier plan_request
+        a salesman that moved since continues from its current node on its path, a salesman that is no longer on its
+        path waits for the next plan
+        :param salesman_index_path_list: one path per salesman, see algorithm.util.Plan
+        '''
+        if len(salesman_index_path_list) != len(self.salesman):  # salesmen were removed since, the plan is useless
+            return
+        self.path_length = np.array([len(index_path) for index_path in salesman_index_path_list], dtype=int)
+        self.path_goal = Board.__path_goal(salesman_index_path_list, self.path_length)
+        self.path_offset = np.cumsum(self.path_length) - self.path_length
+        self.last_path = np.concatenate([
+            np.zeros(shape=(0,), dtype=np.int32),
+            *[np.asarray(index_path, dtype=np.int32) for index_path in salesman_index_path_list],
+        ])
+        # cursor on the first occurrence of the current node, at the end of the path if there is none
+        current = self.graph.coord2index[self.salesman[:, 0], self.salesman[:, 1]]
+        step = np.arange(len(self.last_path)) - np.repeat(self.path_offset, self.path_length)
+        on_path = self.last_path == np.repeat(current, self.path_length)
+        first = np.full_like(self.path_length, fill_value=np.iinfo(int).max)
+        np.minimum.at(first, np.repeat(np.arange(len(self.path_length)), self.path_length)[on_path], step[on_path])
+        lost = first == np.iinfo(int).max
+        self.path_cursor = np.where(lost, self.path_length - 1, first)
+        # salesmen that left their path or already finished it need another plan
+        finished = (self.path_length >= 2) & (self.path_length - self.path_cursor == 1)
+        self.need_plan = bool(lost.any() or finished.any())
+
+    def step_plan(self, greedy: bool = False):
+        '''
+        move every salesman one node along its cached path, the salesmen need a new plan once a path is finished
+        :param greedy: salesmen without a path step toward the nearest customer instead of waiting
+        '''
         if self.last_path is None:
-            salesman_index_path_list = controller(
-                self.adj,
-                [self.coord2index[coord] for coord in self.salesman_list],
-                [self.coord2index[coord] for coord in self.customer_list],
-            )
-            salesman_path_list = []
-            for index_path in salesman_index_path_list:
-                salesman_path_list.append([self.index2coord[index] for index in index_path])
-            self.last_path = salesman_path_list
-
-        customer_reach = False
-        for i, path in enumerate(self.last_path):
-            if len(path) == 1:
-                continue
-            if len(path) == 2:
-                customer_reach = True
-                self.salesman_list[i] = path[-1]
-                continue
-            self.salesman_list[i] = path[1]
-            self.last_path[i] = path[1:]
-        if customer_reach:
-            self.last_path = None
+            move = np.zeros(shape=(len(self.salesman),), dtype=bool)
+        else:
+            move = self.path_length - self.path_cursor >= 2
+            self.path_cursor[move] += 1
+            self.salesman[move] = self.graph.index2coord[
+                self.last_path[self.path_offset[move] + self.path_cursor[move]]]
+            if (self.path_length[move] - self.path_cursor[move] == 1).any():
+                self.need_plan = True
+        if greedy:
+            self.__greedy_step(~move)
 
         self.__ensure_valid()
 
     def control_force(self, controller: Controller):
-        self.salesman_list = controller(self.salesman_list)
+        self.salesman = Board.__as_array(controller(Board.__as_list(self.salesman)))
         self.last_path = None
+        self.need_plan = True
         self.__ensure_valid()
 
+    def control_replay(self, customer: np.ndarray, salesman: np.ndarray):
+        '''
+        put the customers and salesmen where a recording has them, the rules of the game do not apply
+        :param customer: (num_customer, 2) hw
+        :param salesman: (num_salesman, 2) hw of every salesman the game started with, negative once removed
+        '''
+        alive = salesman[:, 0] >= 0
+        self.customer = np.asarray(customer, dtype=int).reshape(-1, 2)
+        self.salesman = np.asarray(salesman[alive], dtype=int).reshape(-1, 2)
+        self.salesman_id = np.flatnonzero(alive)
+        self.last_path = None
+        self.need_plan = True
+
+    def __append_path(self, salesman: np.ndarray, salesman_index_path_list: List[np.ndarray]):
+        # new paths of some salesmen go after the cached ones, the buffer is compacted once it is mostly stale
+        length = np.array([len(index_path) for index_path in salesman_index_path_list], dtype=int)
+        self.path_offset[salesman] = len(self.last_path) + np.cumsum(length) - length
+        self.path_length[salesman] = length
+        self.path_cursor[salesman] = 0
+        self.path_goal[salesman] = Board.__path_goal(salesman_index_path_list, length)
+        self.last_path = np.concatenate([
+            self.last_path,
+            *[np.asarray(index_path, dtype=np.int32) for index_path in salesman_index_path_list],
+        ])
+        if len(self.last_path) > 2 * self.path_length.sum():
+            position = np.repeat(self.path_offset - np.cumsum(self.path_length) + self.path_length, self.path_length)
+            self.last_path = self.last_path[np.arange(self.path_length.sum()) + position]
+            self.path_offset = np.cumsum(self.path_length) - self.path_length
+
     def view(self) -> Tuple[List[Coord], List[Coord], List[Coord]]:
         return (
-            self.obstacle_list,
-            self.customer_list,
-            self.salesman_list,
+            Board.__as_list(self.obstacle),
+            Board.__as_list(self.customer),
+            Board.__as_list(self.salesman),
         )
 
+    @trace.traced("ensure_valid")
     def __ensure_valid(self):
-        # remove all invalid obstacle: outside of the map
-        del_obstacle_indices = []
-        for i, coord in enumerate(self.obstacle_list):
-            if not self.__in_range(coord):
-                del_obstacle_indices.append(i)
-        del_obstacle_indices.reverse()
-        for i in del_obstacle_indices:
-            del self.obstacle_list[i]
         # remove all invalid salesman: outside of the map or on an obstacle
-        del_salesman_indices = []
-        for i, coord in enumerate(self.salesman_list):
-            if (not self.__in_range(coord)) or (coord in self.obstacle_list):
-                del_salesman_indices.append(i)
-        del_salesman_indices.reverse()
-        for i in del_salesman_indices:
-            del self.salesman_list[i]
+        keep_salesman = self.__on_free(self.salesman)
+        if not keep_salesman.all():
+            self.salesman = self.salesman[keep_salesman]
+            self.salesman_id = self.salesman_id[keep_salesman]
             if self.last_path is not None:
-                del self.last_path[i]
-
+                self.path_offset = self.path_offset[keep_salesman]
+                self.path_length = self.path_length[keep_salesman]
+                self.path_cursor = self.path_cursor[keep_salesman]
+                self.path_goal = self.path_goal[keep_salesman]
         # remove all invalid customer: outside of the map or on an obstacle or a salesman
-        del_customer_indices = []
-        for i, coord in enumerate(self.customer_list):
-            if (not self.__in_range(coord)) or (coord in self.obstacle_list) or (coord in self.salesman_list):
-                del_customer_indices.append(i)
-        del_customer_indices.reverse()
-        for i in del_customer_indices:
-            del self.customer_list[i]
+        width = self.shape[1]
+        keep_customer = self.__on_free(self.customer)
+        keep_customer &= ~np.isin(
+            self.customer[:, 0] * width + self.customer[:, 1],
+            self.salesman[:, 0] * width + self.salesman[:, 1],
+        )
+        if not keep_customer.all():
+            self.customer = self.customer[keep_customer]
+
+    def __greedy_step(self, idle: np.ndarray):
+        # step along the axis with the larger manhattan gap to the nearest customer, the other axis if that cell is
+        # an obstacle, otherwise stay
+        if len(self.customer) == 0 or not idle.any():
+            return
+        position = self.salesman[idle]
+        _, nearest = sp.spatial.cKDTree(self.customer).query(position, p=1)
+        delta = self.customer[nearest] - position
+        major = (np.abs(delta[:, 0]) >= np.abs(delta[:, 1]))[:, None]
+        first_shift = np.sign(delta) * np.where(major, [1, 0], [0, 1])
+        moved = np.zeros(shape=(len(position),), dtype=bool)
+        for shift in (first_shift, np.sign(delta) - first_shift):
+            # moving toward a customer never leaves the map
+            target = position + shift
+            ok = ~moved & shift.any(axis=1) & self.graph.free[target[:, 0], target[:, 1]]
+            position[ok] = target[ok]
+            moved |= ok
+        self.salesman[idle] = position
 
     @staticmethod
-    def __random_mask(shape: Tuple[int, int], count: int) -> List[Coord]:
-        coord_list = []
-        for h in range(shape[0]):
-            for w in range(shape[1]):
-                coord_list.append((h, w))
-        indices = np.random.choice(range(len(coord_list)), size=(count,), replace=False)
-        return [coord for i_c, coord in enumerate(coord_list) if i_c in indices]
-
-    def __in_range(self, coord: Tuple[int, int]) -> bool:
+    def __as_array(coord_list: Union[List[Coord], np.ndarray]) -> np.ndarray:
+        return np.array(coord_list, dtype=int).reshape(-1, 2)
+
+    @staticmethod
+    def __as_list(coord: np.ndarray) -> List[Coord]:
+        return [(h, w) for h, w in coord.tolist()]
+
+    @staticmethod
+    def __path_goal(salesman_index_path_list: List[np.ndarray], length: np.ndarray) -> np.ndarray:
+        # goals of a Plan, the last node of any other path that moves
+        goal = getattr(salesman_index_path_list, "goal", None)
+        if goal is not None:
+            return np.array(goal, dtype=int).reshape(-1)
+        last = np.array([index_path[-1] if len(index_path) > 0 else -1 for index_path in salesman_index_path_list])
+        return np.where(length >= 2, last, -1).astype(int)
+
+    def __in_range(self, coord: np.ndarray) -> np.ndarray:
         H, W = self.shape
-        h, w = coord
-        return h < H and h >= 0 and w < W and w >= 0
+        h, w = coord[:, 0], coord[:, 1]
+        return (h < H) & (h >= 0) & (w < W) & (w >= 0)
+
+    def __on_free(self, coord: np.ndarray) -> np.ndarray:
+        on_free = self.__in_range(coord)
+        on_free[on_free] = self.graph.free[coord[on_free, 0], coord[on_free, 1]]
+        return on_free
 
     @staticmethod
-    def __create_graph(shape: Tuple[int, int], obstacle: List[Coord]) -> Tuple[
-        np.ndarray, List[Coord], Dict[Coord, int]]:
+    def __create_graph(shape: Tuple[int, int], obstacle: np.ndarray) -> Grid:
         height, width = shape
-        index2coord: List[Coord] = []
-        coord2index: Dict[Coord, int] = {}
-        for h in range(height):
-            for w in range(width):
-                if (h, w) not in obstacle:
-                    index2coord.append((h, w))
-                    coord2index[(h, w)] = len(index2coord) - 1
-        num_nodes = len(index2coord)
-        adj = np.zeros(shape=(num_nodes, num_nodes), dtype=bool)
-        for index1 in range(num_nodes):
-            h0, w0 = index2coord[index1]
-            neighbours = [
-                (h0 + 1, w0),
-                (h0 - 1, w0),
-                (h0, w0 + 1),
-                (h0, w0 - 1),
-            ]
-            for h1, w1 in neighbours:
-                if (h1, w1) in coord2index:
-                    index2 = coord2index[(h1, w1)]
-                    if index2 > index1:
-                        adj[index1][index2] = True
-                        adj[index2][index1] = True
-        return adj, index2coord, coord2index
+        free = np.ones(shape=shape, dtype=bool)
+        h, w = Board.__as_array(obstacle).T
+        in_range = (h >= 0) & (h < height) & (w >= 0) & (w < width)
+        free[h[in_range], w[in_range]] = False
+        return Grid(free)
@@ -1,6 +1,9 @@
 from typing import List, Callable, Tuple
+
 import numpy as np
 
-AutoController = Callable[[np.ndarray, List[int], List[int]], List[List[int]]]
+from algorithm.grid import Graph
+
+AutoController = Callable[[Graph, List[int], List[int]], List[np.ndarray]]
 
 Controller = Callable[[List[Tuple[int, int]]], List[Tuple[int, int]]]
@@ -0,0 +1,79 @@
+from typing import Tuple, Union, List
+
+import numpy as np
+import scipy as sp
+import scipy.ndimage
+
+Coord = Tuple[int, int]
+
+
+def random_board(
+        shape: Tuple[int, int],
+        obstacle: Union[List[Coord], int],
+        customer: Union[List[Coord], int],
+        salesman: Union[List[Coord], int],
+        rng: np.random.Generator,
+        reachable: bool = False,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    '''
+    place obstacles, customers and salesmen given by count on distinct cells, away from the ones given by coordinates
+    :param shape: hw
+    :param obstacle: coordinates or number of random cells
+    :param customer: coordinates or number of random cells
+    :param salesman: coordinates or number of random cells
+    :param rng: random generator
+    :param reachable: random customers are only placed in a connected component that holds a salesman
+    :return: (num_obstacle, 2), (num_customer, 2), (num_salesman, 2) hw in row-major order for random ones
+    '''
+    size = shape[0] * shape[1]
+    taken = np.zeros(shape=(size,), dtype=bool)
+    entity_list = [obstacle, salesman, customer]
+    cell_list = []
+    for entity in entity_list:
+        if isinstance(entity, int):
+            cell_list.append(None)
+        else:
+            coord = np.array(entity, dtype=int).reshape(-1, 2)
+            taken[np.ravel_multi_index(tuple(_in_range(shape, coord).T), shape)] = True
+            cell_list.append(coord)
+
+    # obstacles and salesmen in one draw, customers too unless they depend on where the first two landed
+    joint = [i for i, entity in enumerate(entity_list) if isinstance(entity, int) and not (i == 2 and reachable)]
+    _sample(shape, taken, np.ones(shape=(size,), dtype=bool), joint, entity_list, cell_list, rng)
+    if isinstance(customer, int) and reachable:
+        free = np.ones(shape=shape, dtype=bool)
+        free[tuple(_in_range(shape, cell_list[0]).T)] = False
+        label = connected_component(free)
+        salesman_label = label[tuple(_in_range(shape, cell_list[1]).T)]
+        allowed = np.isin(label, salesman_label[salesman_label > 0]).reshape(-1)
+        _sample(shape, taken, allowed, [2], entity_list, cell_list, rng)
+    obstacle, salesman, customer = cell_list
+    return obstacle, customer, salesman
+
+
+def connected_component(free: np.ndarray) -> np.ndarray:
+    '''
+    :param free: (h, w) True on free cells
+    :return: (h, w) label of the 4-connected component of each free cell, from 1, 0 on obstacles
+    '''
+    label, _ = sp.ndimage.label(free)
+    return label
+
+
+def _sample(shape: Tuple[int, int], taken: np.ndarray, allowed: np.ndarray, index_list: List[int],
+             count_list: List, cell_list: List, rng: np.random.Generator):
+    count = [count_list[i] for i in index_list]
+    if len(count) == 0:
+        return
+    candidate = np.flatnonzero(allowed & ~taken)
+    if sum(count) > len(candidate):
+        raise ValueError(f"cannot place {sum(count)} entities on {len(candidate)} cells")
+    cell = candidate[rng.choice(len(candidate), size=(sum(count),), replace=False)]
+    taken[cell] = True
+    for i, part in zip(index_list, np.split(cell, np.cumsum(count)[:-1])):
+        cell_list[i] = np.stack(np.unravel_index(np.sort(part), shape), axis=1)
+
+
+def _in_range(shape: Tuple[int, int], coord: np.ndarray) -> np.ndarray:
+    h, w = coord[:, 0], coord[:, 1]
+    return coord[(h >= 0) & (h < shape[0]) & (w >= 0) & (w < shape[1])]
@@ -0,0 +1,56 @@
+import functools
+import os
+from typing import Tuple, Dict
+
+import pygame
+
+ASSET_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets")
+
+# tiles of the atlas, in order
+TILE_NAME = ("obstacle", "customer", "salesman", "salesman_left", "salesman_right")
+
+
+@functools.lru_cache(maxsize=None)
+def load(name: str) -> pygame.Surface:
+    '''
+    decode an image of the asset directory once, salesman_right is salesman_left flipped
+    '''
+    if name == "salesman_right":
+        return pygame.transform.flip(load("salesman_left"), True, False)
+    return pygame.image.load(os.path.join(ASSET_DIR, name + ".bmp"))
+
+
+class Atlas(object):
+    '''
+    every tile scaled to one cell size, side by side on a single surface, in the pixel format of the display once it
+    is set
+    '''
+    cell_size: Tuple[int, int]  # wh
+    surface: pygame.Surface
+    tile: Dict[str, pygame.Surface]  # subsurfaces of surface
+
+    def __init__(self, cell_size: Tuple[int, int]):
+        super(Atlas, self).__init__()
+        self.cell_size = cell_size
+        c_width, c_height = cell_size
+        rect = {name: pygame.Rect((i * c_width, 0), cell_size) for i, name in enumerate(TILE_NAME)}
+        # the tiles have per pixel alpha, they are scaled into place rather than blended
+        self.surface = pygame.Surface((c_width * len(TILE_NAME), c_height), pygame.SRCALPHA)
+        for name in TILE_NAME:
+            pygame.transform.scale(load(name), cell_size, self.surface.subsurface(rect[name]))
+        if pygame.display.get_surface() is not None:
+            self.surface = self.surface.convert_alpha()
+        self.tile = {name: self.surface.subsurface(rect[name]) for name in TILE_NAME}
+
+
+@functools.lru_cache(maxsize=None)
+def get_atlas(cell_size: Tuple[int, int]) -> Atlas:
+    return Atlas(cell_size)
+
+
+@functools.lru_cache(maxsize=None)
+def get_screen(name: str, screen_size: Tuple[int, int]) -> pygame.Surface:
+    '''
+    full screen image, youwin_qr or youlose_qr
+    '''
+    return pygame.transform.scale(load(name), screen_size)
@@ -1,11 +1,23 @@
+import sys
+import time
 from enum import Enum
 from typing import Tuple, List, Optional
 
+import numpy as np
 import pygame
 
+from algorithm import trace
 from board.board import Board
 from board.controller import AutoController
+from game.atlas import get_atlas, get_screen
 from game.global_controller import global_control
+from game.planner import Planner
+from simulation.recording import Recorder, Recording
+
+try:
+    import resource
+except ImportError:  # not on windows
+    resource = None
 
 
 def darken_and_blur(surface: pygame.Surface, amt: float = 30, opacity=200):
@@ -24,24 +36,45 @@ def darken_and_blur(surface: pygame.Surface, amt: float = 30, opacity=200):
     return surf
 
 
+def peak_memory() -> Optional[float]:
+    '''
+    :return: peak resident memory of the process in MiB, None if unknown
+    '''
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / (1 << 10)
+
+
 class Game(object):
     board: Board
     gui: bool
     cell_dim: Tuple[int, int]  # wh
     cell_size: Tuple[int, int]  # wh
     screen_size: Tuple[int, int]  # wh
-    obstacle_surf: pygame.Surface = pygame.image.load("./game/assets/obstacle.bmp")
-    customer_surf: pygame.Surface = pygame.image.load("./game/assets/customer.bmp")
-    salesman_surf: pygame.Surface = pygame.image.load("./game/assets/salesman.bmp")
-    salesman_surf_left: pygame.Surface = pygame.image.load("./game/assets/salesman_left.bmp")
-    salesman_surf_right: pygame.Surface = pygame.transform.flip(salesman_surf_left, True, False)
-    youwin_surf: pygame.Surface = pygame.image.load("./game/assets/youwin_qr.bmp")
-    youlose_surf: pygame.Surface = pygame.image.load("./game/assets/youlose_qr.bmp")
+    # tiles of the atlas of cell_size, see game.atlas
+    obstacle_surf: pygame.Surface
+    customer_surf: pygame.Surface
+    salesman_surf: pygame.Surface
+    salesman_surf_left: pygame.Surface
+    salesman_surf_right: pygame.Surface
     screen: pygame.Surface
+    background: pygame.Surface  # blank board with the obstacles, they never move
+    fps: int  # render rate
+    step_rate: Optional[float]  # auto controller steps per second, one per frame if None
+    plan_deadline: Optional[float]  # seconds a replan may take before idle salesmen step greedily, wait if None
+    overlay: bool  # draw frame time, replan time and memory in the top left corner
+    font: pygame.font.Font
+    overlay_surf: pygame.Surface
 
-    def __init__(self, board: Board, cell_size: Tuple[int, int] = None):
+    def __init__(self, board: Board, cell_size: Tuple[int, int] = None, fps: int = 60,
+                 step_rate: Optional[float] = None, plan_deadline: Optional[float] = 0.2, overlay: bool = False):
         self.board = board
         self.gui = cell_size is not None
+        self.fps = fps
+        self.step_rate = step_rate
+        self.plan_deadline = plan_deadline
+        self.overlay = overlay
         if self.gui:
             height, width = board.shape
             c_width, c_height = cell_size
@@ -49,14 +82,20 @@ class Game(object):
             self.cell_dim = board.shape[1], board.shape[0]
             self.cell_size = cell_size
             self.screen_size = screen_size
-            self.obstacle_surf = pygame.transform.scale(Game.obstacle_surf, cell_size)
-            self.customer_surf = pygame.transform.scale(Game.customer_surf, cell_size)
-            self.salesman_surf = pygame.transform.scale(Game.salesman_surf, cell_size)
-            self.salesman_surf_left = pygame.transform.scale(Game.salesman_surf_left, cell_size)
-            self.salesman_surf_right = pygame.transform.scale(Game.salesman_surf_right, cell_size)
-            self.youwin_surf = pygame.transform.scale(Game.youwin_surf, screen_size)
-            self.youlose_surf = pygame.transform.scale(Game.youlose_surf, screen_size)
             self.screen = pygame.display.set_mode(size=screen_size)
+            tile = get_atlas(cell_size).tile
+            self.obstacle_surf = tile["obstacle"]
+            self.customer_surf = tile["customer"]
+            self.salesman_surf = tile["salesman"]
+            self.salesman_surf_left = tile["salesman_left"]
+            self.salesman_surf_right = tile["salesman_right"]
+            self.background = pygame.Surface(screen_size).convert()
+            self.background.fill((255, 255, 255))
+            self.background.blits(self.__blits_sequence(board.obstacle.tolist(), self.obstacle_surf))
+            if self.overlay:
+                pygame.font.init()
+                self.font = pygame.font.Font(None, 20)
+                self.overlay_surf = pygame.Surface((min(screen_size[0], 420), self.font.get_linesize() + 4)).convert()
 
     def get_salesman_surf(self, current: pygame.Surface, command: str) -> pygame.Surface:
         text2salesmandsurf = {
@@ -67,7 +106,14 @@ class Game(object):
         }
         return text2salesmandsurf.get(command, current)
 
-    def loop(self, auto_controller: Optional[AutoController] = None) -> str:
+    def loop(self, auto_controller: Optional[AutoController] = None, recorder: Optional[Recorder] = None,
+             recording: Optional[Recording] = None) -> str:
+        '''
+        :param auto_controller: moves the salesmen, the keyboard does if None
+        :param recorder: records every step of the board
+        :param recording: replay this recording at step_rate instead, the board must be recording.board()
+        :return: r to restart, q to quit, empty if the window was closed
+        '''
         class State(Enum):
             RUNNING = 0  # playing
             QUIT = 1  # quit
@@ -78,7 +124,21 @@ class Game(object):
         state: State = State.RUNNING
         return_msg: str = ""
 
+        clock = pygame.time.Clock()
+        planner = Planner(auto_controller, self.board.graph) if auto_controller is not None else None
+        start_time = time.perf_counter()
+        frame_time_list: List[float] = []  # seconds of work of each frame, without the wait for the frame rate
+        step_time = 0.0  # seconds of simulation owed to the auto controller
+        # cells (h * width + w) drawn on the screen and the step they show, None forces a full redraw
+        width = self.board.shape[1]
+        drawn_customer: Optional[np.ndarray] = None
+        drawn_salesman: Optional[np.ndarray] = None
+        drawn_steps = -1
+        drawn_salesman_surf = salesman_surf
+
         while state != State.QUIT:
+            elapsed = clock.tick(self.fps) / 1000
+            frame_time_list.append(clock.get_rawtime() / 1000)
             # event handling
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
@@ -88,45 +148,144 @@ class Game(object):
                         if event.text in ("r", "q"):
                             state = State.QUIT
                             return_msg = event.text
-                    if state == State.RUNNING and auto_controller is None:
+                    if state == State.RUNNING and auto_controller is None and recording is None:
                         num_steps += 1
                         self.board.control_force(global_control(event.text))
-                        text2salesmandsurf = {
-                            "a": self.salesman_surf_left,
-                            "w": self.salesman_surf,
-                            "d": self.salesman_surf_right,
-                            "s": self.salesman_surf,
-                        }
-                        salesman_surf = text2salesmandsurf.get(event.text, salesman_surf)
+                        salesman_surf = self.get_salesman_surf(salesman_surf, event.text)
+                        if recorder is not None:
+                            recorder.record()
             #
             if state == State.RUNNING:
                 # draw
-                obstacle_list, customer_list, salesman_list = self.board.view()
-                if len(customer_list) == 0:  # win
+                if len(self.board.customer) == 0:  # win
                     self.screen.blit(darken_and_blur(self.screen), pygame.Rect((0, 0), self.screen_size))
-                    self.screen.blit(self.youwin_surf, pygame.Rect((0, 0), self.screen_size))
+                    self.screen.blit(get_screen("youwin_qr", self.screen_size), pygame.Rect((0, 0), self.screen_size))
+                    with trace.span("flip"):
+                        pygame.display.flip()
                     state = State.ENDED
-                elif len(salesman_list) == 0:  # lose
+                elif len(self.board.salesman) == 0:  # lose
                     self.screen.blit(darken_and_blur(self.screen), pygame.Rect((0, 0), self.screen_size))
-                    self.screen.blit(self.youlose_surf, pygame.Rect((0, 0), self.screen_size))
+                    self.screen.blit(get_screen("youlose_qr", self.screen_size), pygame.Rect((0, 0), self.screen_size))
+                    with trace.span("flip"):
+                        pygame.display.flip()
                     state = State.ENDED
                 else:  # running
-                    self.screen.fill((255, 255, 255))
-                    self.screen.blits(self.__blits_sequence(obstacle_list, self.obstacle_surf))
-                    self.screen.blits(self.__blits_sequence(customer_list, self.customer_surf))
-                    self.screen.blits(self.__blits_sequence(salesman_list, salesman_surf))
-
-                pygame.display.flip()
+                    if self.overlay:
+                        self.__draw_overlay(frame_time_list[-1], planner)
+                    if drawn_customer is None or num_steps != drawn_steps or salesman_surf is not drawn_salesman_surf:
+                        customer = self.board.customer[:, 0] * width + self.board.customer[:, 1]
+                        salesman = self.board.salesman[:, 0] * width + self.board.salesman[:, 1]
+                    else:  # the board only changes on a step
+                        customer, salesman = drawn_customer, drawn_salesman
+                    if drawn_customer is None:
+                        with trace.span("blit"):
+                            self.screen.blit(self.background, (0, 0))
+                            self.screen.blits(self.__blits_sequence(self.board.customer.tolist(), self.customer_surf))
+                            self.screen.blits(self.__blits_sequence(self.board.salesman.tolist(), salesman_surf))
+                            if self.overlay:
+                                self.screen.blit(self.overlay_surf, (0, 0))
+                        with trace.span("flip"):
+                            pygame.display.flip()
+                    else:
+                        if salesman is drawn_salesman:
+                            dirty = np.zeros(shape=(0,), dtype=int)
+                        else:
+                            if salesman_surf is not drawn_salesman_surf:
+                                dirty_salesman = np.concatenate([salesman, drawn_salesman])
+                            elif len(salesman) == len(drawn_salesman):  # salesmen keep their order
+                                moved = salesman != drawn_salesman
+                                dirty_salesman = np.concatenate([salesman[moved], drawn_salesman[moved]])
+                            else:
+                                dirty_salesman = np.setxor1d(salesman, drawn_salesman)
+                            dirty = np.union1d(np.setxor1d(customer, drawn_customer), dirty_salesman)
+                        self.__redraw(dirty, customer, salesman, salesman_surf)
+                    drawn_customer, drawn_salesman = customer, salesman
+                    drawn_steps, drawn_salesman_surf = num_steps, salesman_surf
 
                 # control
-                if auto_controller is not None:
-                    num_steps += 1
-                    self.board.control_auto(auto_controller)
+                if auto_controller is not None or recording is not None:
+                    if self.step_rate is None:
+                        num_due = 1
+                    else:
+                        step_time += elapsed
+                        num_due = int(step_time * self.step_rate)
+                        step_time -= num_due / self.step_rate
+                    for _ in range(num_due):
+                        if recording is not None:
+                            if num_steps == recording.num_ticks:
+                                break
+                            num_steps += 1
+                            self.board.control_replay(recording.customer_at(num_steps), recording.salesman[num_steps])
+                        else:
+                            num_steps += 1
+                            self.__step_auto(planner)
+                        if recorder is not None:
+                            recorder.record()
 
+        if planner is not None:
+            planner.close()
         pygame.quit()
-        print(f"finished in {num_steps} steps")
+        print(self.__summary(num_steps, time.perf_counter() - start_time, frame_time_list, planner))
         return return_msg
 
+    def __summary(self, num_steps: int, wall_time: float, frame_time_list: List[float],
+                  planner: Optional[Planner]) -> str:
+        frame_ms = 1000 * np.array(frame_time_list[1:] or [0.0])
+        line_list = [
+            f"finished in {num_steps} steps, {len(frame_time_list)} frames in {wall_time:.1f} s",
+            f"frame: mean {frame_ms.mean():.1f} ms, p99 {np.percentile(frame_ms, 99):.1f} ms, "
+            f"max {frame_ms.max():.1f} ms",
+        ]
+        if planner is not None:
+            plan_ms = 1000 * np.array(planner.plan_time or [0.0])
+            line_list.append(
+                f"replan: {len(planner.plan_time)} plans, mean {plan_ms.mean():.1f} ms, max {plan_ms.max():.1f} ms")
+        memory = peak_memory()
+        if memory is not None:
+            line_list.append(f"peak memory: {memory:.0f} MiB")
+        if trace.enabled():
+            line_list.append(trace.summary())
+        return "\n".join(line_list)
+
+    def __draw_overlay(self, frame_time: float, planner: Optional[Planner]):
+        text = f"frame {1000 * frame_time:.1f} ms"
+        if planner is not None and len(planner.plan_time) > 0:
+            text += f"  replan {1000 * planner.plan_time[-1]:.0f} ms"
+            if planner.pending():
+                text += f" ({1000 * planner.elapsed():.0f} ms)"
+        memory = peak_memory()
+        if memory is not None:
+            text += f"  mem {memory:.0f} MiB"
+        self.overlay_surf.fill((0, 0, 0))
+        self.overlay_surf.blit(self.font.render(text, True, (255, 255, 255)), (4, 2))
+
+    def __step_auto(self, planner: Planner):
+        # planning runs in the background, the salesmen follow the last plan until the new one arrives
+        index_path_list = planner.poll()
+        if index_path_list is not None:
+            self.board.set_plan(index_path_list)
+        if self.board.need_plan and not planner.pending():
+            _, salesman_index_list, customer_index_list = self.board.plan_request()
+            planner.submit(salesman_index_list, customer_index_list)
+        late = planner.pending() and self.plan_deadline is not None and planner.elapsed() > self.plan_deadline
+        self.board.step_plan(greedy=late)
+
+    def __redraw(self, dirty: np.ndarray, customer: np.ndarray, salesman: np.ndarray, salesman_surf: pygame.Surface):
+        # restore the background of the dirty cells, draw what is on them now, push only these cells
+        # cells are h * width + w
+        if len(dirty) == 0 and not self.overlay:
+            return
+        coord = np.stack(np.divmod(dirty, self.board.shape[1]), axis=1)
+        with trace.span("blit"):
+            rect_list = [rect for _, rect in self.__blits_sequence(coord.tolist(), self.background)]
+            self.screen.blits([(self.background, rect, rect) for rect in rect_list])
+            self.screen.blits(self.__blits_sequence(coord[np.isin(dirty, customer)].tolist(), self.customer_surf))
+            self.screen.blits(self.__blits_sequence(coord[np.isin(dirty, salesman)].tolist(), salesman_surf))
+            if self.overlay:
+                rect_list.append(self.screen.blit(self.overlay_surf, (0, 0)))
+        with trace.span("flip"):
+            pygame.display.update(rect_list)
+
     def __blits_sequence(self, indices: List[Tuple[int, int]], surface: pygame.Surface) -> List[
         Tuple[pygame.Surface, pygame.Rect]]:
         # indices h w
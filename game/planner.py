@@ -0,0 +1,89 @@
+import multiprocessing
+import multiprocessing.pool
+import os
+import signal
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from algorithm import trace
+from algorithm.grid import Graph
+from board.controller import AutoController
+
+# controller and graph of the worker process, set once by _init
+_worker: Optional[Tuple[AutoController, Graph]] = None
+
+
+def _init(controller: AutoController, graph: Graph, traced: bool):
+    global _worker
+    # a forked worker inherits the handler of SDL, which turns SIGTERM into a quit event, terminate would hang
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    if hasattr(os, "nice"):  # planning yields the cpu to rendering
+        os.nice(10)
+    # a forked worker inherits the events recorded so far, they would be merged twice
+    trace.reset()
+    if traced:
+        trace.enable()
+    _worker = (controller, graph)
+
+
+def _plan(agent_list: List[int], goal_list: List[int]) -> Tuple[List[np.ndarray], List[trace.Event]]:
+    controller, graph = _worker
+    return controller(graph, agent_list, goal_list), trace.drain()
+
+
+class Planner(object):
+    '''
+    run an auto controller in a worker process, one plan at a time, so that the render loop never waits for it
+    a thread would not do, scipy holds the GIL for seconds in a large Dijkstra or assignment
+    the graph is sent once, the worker keeps it with its cache of distance fields and the state of the controller
+    the controller must be picklable on platforms that spawn processes
+    the phases traced in the worker are merged into the trace of this process
+    '''
+    pool: multiprocessing.pool.Pool
+    result: Optional[multiprocessing.pool.AsyncResult]
+    submit_time: float
+    plan_time: List[float]  # seconds from submit until the plan was polled, of every plan so far
+
+    def __init__(self, controller: AutoController, graph: Graph):
+        super(Planner, self).__init__()
+        self.pool = multiprocessing.Pool(processes=1, initializer=_init, initargs=(controller, graph, trace.enabled()))
+        self.result = None
+        self.submit_time = 0.0
+        self.plan_time = []
+
+    def submit(self, agent_list: List[int], goal_list: List[int]):
+        if self.result is not None:
+            raise RuntimeError("a plan is already pending")
+        self.submit_time = time.perf_counter()
+        self.result = self.pool.apply_async(_plan, (agent_list, goal_list))
+
+    def pending(self) -> bool:
+        return self.result is not None
+
+    def elapsed(self) -> float:
+        '''
+        :return: seconds since the pending plan was submitted
+        '''
+        return time.perf_counter() - self.submit_time if self.result is not None else 0.0
+
+    def poll(self) -> Optional[List[np.ndarray]]:
+        '''
+        :return: the plan if it is ready, None otherwise, errors of the controller are raised here
+        '''
+        if self.result is None or not self.result.ready():
+            return None
+        result, self.result = self.result, None
+        index_path_list, event_list = result.get()
+        self.plan_time.append(time.perf_counter() - self.submit_time)
+        if trace.enabled():
+            trace.merge(event_list)
+            trace.record("replan", self.submit_time, self.plan_time[-1])
+        return index_path_list
+
+    def close(self):
+        # a plan that is still running is dropped
+        self.pool.terminate()
+        self.pool.join()
+        self.result = None
@@ -1,14 +1,21 @@
+import argparse
+import os
 from typing import Tuple, List, Optional
 
-from algorithm.msoc import minimal_sum_of_costs_controller
+from algorithm import trace
+from algorithm.msoc import minimal_sum_of_costs_controller, incremental_minimal_sum_of_costs_controller
 from algorithm.gp import graph_partitioning_controller
 from board.board import Board
 from board.controller import AutoController
 from game import game
+from simulation.recording import Recorder, load
 
 import numpy as np
 
-np.random.seed(1234)
+rng = np.random.default_rng(1234)
+overlay = False
+record_dir: Optional[str] = None
+num_games = 0
 
 
 def board_size(shape: Tuple[int, int]) -> int:
@@ -24,6 +31,8 @@ def play(shape: Tuple[int, int], cell_size: Tuple[int, int], init_salesman_list:
                 obstacle=int(0.1 * board_size(shape)),
                 customer=int(0.05 * board_size(shape)),
                 salesman=init_salesman_list,
+                rng=rng,
+                reachable=True,
             )
         else:
             board = Board(
@@ -31,24 +40,35 @@ def play(shape: Tuple[int, int], cell_size: Tuple[int, int], init_salesman_list:
                 obstacle=int(0.1 * board_size(shape)),
                 customer=int(0.05 * board_size(shape)),
                 salesman=int(0.01 * board_size(shape)),
+                rng=rng,
+                reachable=True,
             )
-        g = game.Game(board, cell_size)
-        output = g.loop(auto_controller)
+        global num_games
+        num_games += 1
+        recorder = Recorder(board) if record_dir is not None else None
+        g = game.Game(board, cell_size, overlay=overlay)
+        output = g.loop(auto_controller, recorder=recorder)
+        if recorder is not None:
+            recorder.finish().save(os.path.join(record_dir, f"game_{num_games}.npz"))
         if output == "r":
             continue
         break
 
 
-def auto():
+def auto(auto_controller: AutoController):
     play(
         shape=(45, 60),
         cell_size=(15, 15),
         init_salesman_list=None,
-        auto_controller=minimal_sum_of_costs_controller,
-        # auto_controller=graph_partitioning_controller,
+        auto_controller=auto_controller,
     )
 
 
+def replay(path: str, cell_size: Tuple[int, int], step_rate: float):
+    recording = load(path)
+    game.Game(recording.board(), cell_size, step_rate=step_rate, overlay=overlay).loop(recording=recording)
+
+
 def single():
     play(
         shape=(15, 20),
@@ -59,5 +79,30 @@ def single():
 
 
 if __name__ == "__main__":
-    single()
-    auto()
+    parser = argparse.ArgumentParser(description="play a single salesman, then watch the auto controller")
+    parser.add_argument("--trace", type=str, default=None,
+                        help="time every phase, chrome trace if the path ends with .json, json lines otherwise")
+    parser.add_argument("--overlay", action="store_true", help="draw frame time, replan time and memory")
+    parser.add_argument("--record", type=str, default=None, help="save every game as .npz in this directory")
+    parser.add_argument("--replay", type=str, default=None, help="replay a recorded .npz instead of playing")
+    parser.add_argument("--speed", type=float, default=10.0, help="steps per second of a replay")
+    parser.add_argument("--controller", type=str, default="msoc", choices=["msoc", "imsoc", "gp"],
+                        help="auto controller: minimal sum of costs, its incremental version or graph partitioning")
+    args = parser.parse_args()
+    overlay = args.overlay
+    record_dir = args.record
+    if record_dir is not None:
+        os.makedirs(record_dir, exist_ok=True)
+    if args.trace is not None:
+        trace.enable()
+    if args.replay is not None:
+        replay(args.replay, cell_size=(15, 15), step_rate=args.speed)
+    else:
+        single()
+        auto({
+            "msoc": lambda: minimal_sum_of_costs_controller,
+            "imsoc": incremental_minimal_sum_of_costs_controller,
+            "gp": lambda: graph_partitioning_controller,
+        }[args.controller]())
+    if args.trace is not None:
+        trace.dump(args.trace)
@@ -0,0 +1,60 @@
+import queue
+from typing import Callable, Optional
+
+import numpy as np
+
+from board.board import Board
+
+# tick, board -> (num_arrival, 2) hw of the customers that arrive before the tick
+Arrival = Callable[[int, Board], np.ndarray]
+
+
+class PoissonArrival(object):
+    '''
+    a Poisson number of customers per tick on uniformly random free cells that a salesman can reach, the board turns
+    away the occupied ones
+    '''
+    rate: float  # customers per tick
+    rng: np.random.Generator
+    # nodes in the components of the salesmen, kept until the board or these components change
+    board: Optional[Board]
+    salesman_component: np.ndarray
+    node: np.ndarray
+
+    def __init__(self, rate: float, rng: Optional[np.random.Generator] = None):
+        super(PoissonArrival, self).__init__()
+        self.rate = rate
+        self.rng = np.random.default_rng() if rng is None else rng
+        self.board = None
+        self.salesman_component = np.zeros(shape=(0,), dtype=int)
+        self.node = np.zeros(shape=(0,), dtype=int)
+
+    def __call__(self, tick: int, board: Board) -> np.ndarray:
+        num_arrival = self.rng.poisson(self.rate)
+        salesman_component = np.unique(board.component[board.salesman[:, 0], board.salesman[:, 1]])
+        if board is not self.board or not np.array_equal(salesman_component, self.salesman_component):
+            self.board, self.salesman_component = board, salesman_component
+            self.node = np.flatnonzero(np.isin(board.component[board.graph.free], salesman_component))
+        if len(self.node) == 0:
+            return np.zeros(shape=(0, 2), dtype=int)
+        return board.graph.index2coord[self.node[self.rng.integers(len(self.node), size=num_arrival)]]
+
+
+class QueueArrival(object):
+    '''
+    customers put on a queue by another thread or process as (h, w), every tick takes all of them
+    '''
+    source: queue.Queue
+
+    def __init__(self, source: queue.Queue):
+        super(QueueArrival, self).__init__()
+        self.source = source
+
+    def __call__(self, tick: int, board: Board) -> np.ndarray:
+        coord_list = []
+        while True:
+            try:
+                coord_list.append(self.source.get_nowait())
+            except queue.Empty:
+                break
+        return np.array(coord_list, dtype=int).reshape(-1, 2)
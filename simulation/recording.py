@@ -0,0 +1,170 @@
+from typing import List, NamedTuple, Optional, Tuple, BinaryIO
+
+import numpy as np
+
+from board.board import Board
+
+
+class Recording(NamedTuple):
+    '''
+    an episode as arrays: the initial board, the position of every salesman at every tick, the tick of every arrival
+    and pickup, coordinates are int16 (int32 on boards wider than that)
+    '''
+    shape: Tuple[int, int]  # hw
+    seed: int  # seed of the board, -1 if unknown
+    obstacle: np.ndarray  # (num_obstacle, 2) hw
+    customer: np.ndarray  # (num_customer, 2) hw of every customer, the ones at tick 0 first
+    salesman: np.ndarray  # (num_ticks + 1, num_salesman, 2) hw at each tick, -1 once the salesman is removed
+    pickup: np.ndarray  # (num_customer,) tick the customer is picked up at, -1 if never
+    arrival: np.ndarray  # (num_customer,) first tick the customer is on the board at, 0 for the initial ones
+
+    @property
+    def num_ticks(self) -> int:
+        return len(self.salesman) - 1
+
+    def customer_at(self, tick: int) -> np.ndarray:
+        return self.customer[(self.arrival <= tick) & ((self.pickup < 0) | (self.pickup > tick))]
+
+    def salesman_at(self, tick: int) -> np.ndarray:
+        '''
+        :return: salesmen that are still on the board
+        '''
+        salesman = self.salesman[tick]
+        return salesman[salesman[:, 0] >= 0]
+
+    def path_length(self) -> np.ndarray:
+        '''
+        :return: (num_salesman,) number of moves of each salesman, its removal is not one
+        '''
+        moved = (np.diff(self.salesman, axis=0) != 0).any(axis=2)
+        return (moved & (self.salesman[1:, :, 0] >= 0)).sum(axis=0)
+
+    def board(self) -> Board:
+        '''
+        :return: board at tick 0
+        '''
+        return Board(
+            shape=self.shape,
+            obstacle=self.obstacle.tolist(),
+            customer=self.customer[self.arrival == 0].tolist(),
+            salesman=self.salesman_at(0).tolist(),
+        )
+
+    def save(self, path: str):
+        '''
+        write an uncompressed .npz, the arrays are already small
+        '''
+        np.savez(
+            path,
+            shape=np.array(self.shape),
+            seed=np.array(self.seed),
+            obstacle=self.obstacle,
+            customer=self.customer,
+            salesman=self.salesman,
+            pickup=self.pickup,
+            arrival=self.arrival,
+        )
+
+
+def load(path: str) -> Recording:
+    with np.load(path) as data:
+        return Recording(
+            shape=tuple(data["shape"].tolist()),
+            seed=int(data["seed"]),
+            obstacle=data["obstacle"],
+            customer=data["customer"],
+            salesman=data["salesman"],
+            pickup=data["pickup"],
+            # recordings without arrivals did not store them
+            arrival=data["arrival"] if "arrival" in data.files else np.zeros_like(data["pickup"]),
+        )
+
+
+def load_many(path_list: List[str]) -> List[Recording]:
+    '''
+    load recordings for offline analysis, every field is an array so nothing is parsed per tick
+    '''
+    return [load(path) for path in path_list]
+
+
+def coord_dtype(shape: Tuple[int, int]) -> np.dtype:
+    return np.dtype(np.int16) if max(shape) <= np.iinfo(np.int16).max else np.dtype(np.int32)
+
+
+class Recorder(object):
+    '''
+    record an episode of a board, call arrive with the customers added before a tick and record after every tick
+    a long run streams its ticks to a raw file instead of holding them, the recording maps that file back
+    '''
+    board: Board
+    seed: int
+    dtype: np.dtype
+    num_salesman: int
+    obstacle: np.ndarray
+    customer: np.ndarray
+    customer_cell: np.ndarray  # flat cell of every customer
+    pickup: np.ndarray
+    arrival: np.ndarray
+    num_ticks: int
+    tick_list: List[np.ndarray]  # ticks held in memory
+    stream_path: Optional[str]
+    stream: Optional[BinaryIO]
+
+    def __init__(self, board: Board, seed: int = -1, stream_path: Optional[str] = None):
+        super(Recorder, self).__init__()
+        self.board = board
+        self.seed = seed
+        self.dtype = coord_dtype(board.shape)
+        self.num_salesman = int(board.salesman_id.max()) + 1 if len(board.salesman_id) > 0 else 0
+        self.obstacle = board.obstacle.astype(self.dtype)
+        self.customer = board.customer.astype(self.dtype)
+        self.customer_cell = board.customer[:, 0] * board.shape[1] + board.customer[:, 1]
+        self.pickup = np.full(shape=(len(board.customer),), fill_value=-1, dtype=np.int32)
+        self.arrival = np.zeros(shape=(len(board.customer),), dtype=np.int32)
+        self.num_ticks = 0
+        self.tick_list = []
+        self.stream_path = stream_path
+        self.stream = open(stream_path, "wb") if stream_path is not None else None
+        self.__write()
+
+    def arrive(self, customer: np.ndarray):
+        '''
+        :param customer: (num_arrival, 2) hw of the customers added to the board since the last tick
+        '''
+        self.customer = np.concatenate([self.customer, customer.astype(self.dtype)])
+        self.customer_cell = np.concatenate([self.customer_cell, customer[:, 0] * self.board.shape[1] + customer[:, 1]])
+        self.pickup = np.concatenate([self.pickup, np.full(shape=(len(customer),), fill_value=-1, dtype=np.int32)])
+        self.arrival = np.concatenate([self.arrival, np.full(shape=(len(customer),), fill_value=self.num_ticks + 1,
+                                                             dtype=np.int32)])
+
+    def record(self):
+        self.num_ticks += 1
+        width = self.board.shape[1]
+        present = np.isin(self.customer_cell, self.board.customer[:, 0] * width + self.board.customer[:, 1])
+        self.pickup[(self.pickup < 0) & ~present] = self.num_ticks
+        self.__write()
+
+    def finish(self) -> Recording:
+        if self.stream is not None:
+            self.stream.close()
+            salesman = np.memmap(self.stream_path, dtype=self.dtype, mode="r",
+                                 shape=(self.num_ticks + 1, self.num_salesman, 2))
+        else:
+            salesman = np.stack(self.tick_list)
+        return Recording(
+            shape=self.board.shape,
+            seed=self.seed,
+            obstacle=self.obstacle,
+            customer=self.customer,
+            salesman=salesman,
+            pickup=self.pickup.copy(),
+            arrival=self.arrival.copy(),
+        )
+
+    def __write(self):
+        tick = np.full(shape=(self.num_salesman, 2), fill_value=-1, dtype=self.dtype)
+        tick[self.board.salesman_id] = self.board.salesman
+        if self.stream is not None:
+            self.stream.write(tick.tobytes())
+        else:
+            self.tick_list.append(tick)
@@ -0,0 +1,235 @@
+import argparse
+import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple, Dict, NamedTuple, Callable, Optional
+
+import numpy as np
+
+from algorithm import trace, oracle
+from algorithm.gp import graph_partitioning_controller
+from algorithm.hpa import hierarchical_controller
+from algorithm.makespan import makespan_controller
+from algorithm.msoc import minimal_sum_of_costs_controller, incremental_minimal_sum_of_costs_controller
+from board.board import Board
+from board.controller import AutoController
+from board.generator import random_board
+from simulation.arrival import PoissonArrival
+from simulation.recording import Recorder
+from simulation.simulator import simulate, Episode
+
+# name -> factory, so that jobs stay picklable and stateful controllers start fresh in every episode
+CONTROLLER: Dict[str, Callable[[], AutoController]] = {
+    "msoc": lambda: minimal_sum_of_costs_controller,
+    "imsoc": incremental_minimal_sum_of_costs_controller,
+    "gp": lambda: graph_partitioning_controller,
+    "makespan": lambda: makespan_controller,
+    "hpa-msoc": lambda: hierarchical_controller(minimal_sum_of_costs_controller),
+    "hpa-gp": lambda: hierarchical_controller(graph_partitioning_controller),
+}
+
+
+class Job(NamedTuple):
+    controller: str
+    seed: int
+    shape: Tuple[int, int]
+    obstacle: float  # fraction of cells
+    customer: float  # fraction of cells
+    salesman: float  # fraction of cells
+    reachable: bool  # every customer is reachable from some salesman
+    max_steps: Optional[int]
+    record_dir: Optional[str] = None  # save the episode to record_dir/<controller>[_<arrival rate>]_<seed>.npz
+    arrival_rate: Optional[float] = None  # customers per tick keep arriving for max_steps ticks
+    layout_seed: Optional[int] = None  # obstacles drawn from this seed instead of seed, shared by the episodes
+    oracle_dir: Optional[str] = None  # distances stored for the layout, see algorithm.oracle
+
+
+def layout(shape: Tuple[int, int], obstacle: float, layout_seed: int) -> Board:
+    '''
+    :return: board with the obstacles of a layout only
+    '''
+    size = shape[0] * shape[1]
+    obstacle, _, _ = random_board(shape, int(obstacle * size), [], [], np.random.default_rng(layout_seed))
+    return Board(shape=shape, obstacle=obstacle.tolist(), customer=[], salesman=[])
+
+
+def run_job(job: Job) -> Tuple[Job, Episode]:
+    size = job.shape[0] * job.shape[1]
+    if job.layout_seed is None:
+        obstacle = int(job.obstacle * size)
+    else:
+        obstacle = layout(job.shape, job.obstacle, job.layout_seed).obstacle.tolist()
+    board = Board(
+        shape=job.shape,
+        obstacle=obstacle,
+        customer=int(job.customer * size),
+        salesman=max(1, int(job.salesman * size)),
+        rng=np.random.default_rng(job.seed),
+        reachable=job.reachable,
+    )
+    if job.oracle_dir is not None:
+        board.graph.oracle = oracle.load(board.graph, job.oracle_dir)
+    arrival = None
+    if job.arrival_rate is not None:
+        arrival = PoissonArrival(job.arrival_rate, rng=np.random.default_rng((job.seed, 1)))
+    if job.record_dir is None:
+        return job, simulate(board, CONTROLLER[job.controller](), job.max_steps, arrival=arrival)
+    recorder = Recorder(board, seed=job.seed)
+    episode = simulate(board, CONTROLLER[job.controller](), job.max_steps, recorder, arrival)
+    rate = "" if job.arrival_rate is None else f"_{job.arrival_rate}"
+    recorder.finish().save(os.path.join(job.record_dir, f"{job.controller}{rate}_{job.seed}.npz"))
+    return job, episode
+
+
+def run_traced_job(job: Job) -> Tuple[Job, Episode, List[trace.Event]]:
+    return (*run_job(job), trace.drain())
+
+
+def run(job_list: List[Job], processes: Optional[int] = None, chunksize: int = 4) -> List[Tuple[Job, Episode]]:
+    '''
+    run episodes over a process pool, the phases traced in the workers are merged if tracing is enabled
+    :param job_list: episodes to run
+    :param processes: number of worker processes, all cores if None, in-process if 0
+    :param chunksize: jobs sent to a worker at once
+    :return: (job, episode) in the order of job_list
+    '''
+    if processes == 0:
+        return [run_job(job) for job in job_list]
+    if not trace.enabled():
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            return list(executor.map(run_job, job_list, chunksize=chunksize))
+    with ProcessPoolExecutor(max_workers=processes, initializer=trace.enable) as executor:
+        result_list = []
+        for job, episode, event_list in executor.map(run_traced_job, job_list, chunksize=chunksize):
+            trace.merge(event_list)
+            result_list.append((job, episode))
+        return result_list
+
+
+def aggregate(result_list: List[Tuple[Job, Episode]]) -> List[Dict[str, float]]:
+    '''
+    one row per controller: mean over episodes
+    '''
+    table: List[Dict[str, float]] = []
+    for name in dict.fromkeys(job.controller for job, _ in result_list):
+        episode_list = [episode for job, episode in result_list if job.controller == name]
+        num_replans = np.array([e.num_replans for e in episode_list])
+        planning_time = np.array([e.planning_time for e in episode_list])
+        table.append({
+            "controller": name,
+            "episodes": len(episode_list),
+            "finished": np.mean([e.finished for e in episode_list]),
+            "steps": np.mean([e.num_steps for e in episode_list]),
+            "steps_std": np.std([e.num_steps for e in episode_list]),
+            "replans": np.mean(num_replans),
+            "planning_s": np.mean(planning_time),
+            "per_replan_ms": 1000 * planning_time.sum() / max(1, num_replans.sum()),
+            "max_replan_ms": 1000 * max(e.max_planning_time for e in episode_list),
+            "path_length": np.mean([sum(e.path_length) for e in episode_list]),
+        })
+    return table
+
+
+def aggregate_stream(result_list: List[Tuple[Job, Episode]]) -> List[Dict[str, float]]:
+    '''
+    one row per controller and arrival rate: throughput, percentiles of the wait of every served customer and of the
+    latency of every replan
+    '''
+    table: List[Dict[str, float]] = []
+    for name, rate in dict.fromkeys((job.controller, job.arrival_rate) for job, _ in result_list):
+        episode_list = [episode for job, episode in result_list
+                        if job.controller == name and job.arrival_rate == rate]
+        wait_time = np.array([t for e in episode_list for t in e.wait_time], dtype=float)
+        replan_time = np.array([t for e in episode_list for t in e.replan_time], dtype=float)
+        wait_p50, wait_p90, wait_p99 = np.percentile(wait_time, [50, 90, 99]) if len(wait_time) > 0 else [np.nan] * 3
+        replan_p50, replan_p99 = np.percentile(replan_time, [50, 99]) if len(replan_time) > 0 else [np.nan] * 2
+        table.append({
+            "controller": name,
+            "arrival_rate": rate,
+            "episodes": len(episode_list),
+            "served_per_1000": 1000 * sum(e.num_served for e in episode_list) / max(1, sum(e.num_steps for e in
+                                                                                           episode_list)),
+            "wait_p50": wait_p50,
+            "wait_p90": wait_p90,
+            "wait_p99": wait_p99,
+            "replans": np.mean([e.num_replans for e in episode_list]),
+            "replan_p50_ms": 1000 * replan_p50,
+            "replan_p99_ms": 1000 * replan_p99,
+            "max_replan_ms": 1000 * max(e.max_planning_time for e in episode_list),
+        })
+    return table
+
+
+def format_table(table: List[Dict[str, float]]) -> str:
+    if len(table) == 0:
+        return ""
+    header = list(table[0].keys())
+    row_list = [[f"{row[key]:.3f}" if isinstance(row[key], float) else str(row[key]) for key in header]
+                for row in table]
+    width = [max(len(h), *(len(row[i]) for row in row_list)) for i, h in enumerate(header)]
+    line_list = [" | ".join(h.rjust(w) for h, w in zip(header, width))]
+    line_list.append("-+-".join("-" * w for w in width))
+    for row in row_list:
+        line_list.append(" | ".join(cell.rjust(w) for cell, w in zip(row, width)))
+    return "\n".join(line_list)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="compare auto controllers over seeded headless episodes")
+    parser.add_argument("--controller", nargs="+", default=["msoc", "gp"], choices=list(CONTROLLER.keys()))
+    parser.add_argument("--episodes", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=1234, help="episode i uses seed + i for every controller")
+    parser.add_argument("--shape", type=int, nargs=2, default=[45, 60])
+    parser.add_argument("--obstacle", type=float, default=0.1)
+    parser.add_argument("--customer", type=float, default=0.05)
+    parser.add_argument("--salesman", type=float, default=0.01)
+    parser.add_argument("--reachable", action="store_true", help="place customers only where a salesman can reach")
+    parser.add_argument("--max-steps", type=int, default=None, help="1000 if customers arrive")
+    parser.add_argument("--arrival-rate", type=float, nargs="+", default=None,
+                        help="customers per tick, one stream per rate, they keep arriving for --max-steps ticks")
+    parser.add_argument("--processes", type=int, default=os.cpu_count())
+    parser.add_argument("--record", type=str, default=None, help="save every episode as .npz in this directory")
+    parser.add_argument("--layout-seed", type=int, default=None, help="every episode on the obstacles of this seed")
+    parser.add_argument("--oracle", type=str, default=None,
+                        help="directory of stored distances per layout, the layout of --layout-seed is stored first, "
+                             "needs --layout-seed, skipped if the layout has more than 16384 free cells")
+    parser.add_argument("--trace", type=str, default=None,
+                        help="time every phase, chrome trace if the path ends with .json, json lines otherwise")
+    args = parser.parse_args()
+    if args.oracle is not None and args.layout_seed is None:
+        parser.error("--oracle needs --layout-seed, episodes on random layouts never query the same distances")
+    if args.trace is not None:
+        trace.enable()
+    if args.record is not None:
+        os.makedirs(args.record, exist_ok=True)
+    if args.oracle is not None:
+        layout_graph = layout(tuple(args.shape), args.obstacle, args.layout_seed).graph
+        if oracle.load(layout_graph, args.oracle) is None:
+            # customers may be on any free cell, so every node is a source
+            try:
+                oracle.build(layout_graph, args.oracle)
+            except ValueError as error:
+                warnings.warn(f"--oracle is skipped: {error}")
+                args.oracle = None
+
+    if args.arrival_rate is None:
+        job_list = [
+            Job(name, args.seed + i, tuple(args.shape), args.obstacle, args.customer, args.salesman, args.reachable,
+                args.max_steps, args.record, None, args.layout_seed, args.oracle)
+            for name in args.controller
+            for i in range(args.episodes)
+        ]
+        print(format_table(aggregate(run(job_list, processes=args.processes))))
+    else:
+        max_steps = 1000 if args.max_steps is None else args.max_steps
+        job_list = [
+            Job(name, args.seed + i, tuple(args.shape), args.obstacle, args.customer, args.salesman, args.reachable,
+                max_steps, args.record, rate, args.layout_seed, args.oracle)
+            for name in args.controller
+            for rate in args.arrival_rate
+            for i in range(args.episodes)
+        ]
+        print(format_table(aggregate_stream(run(job_list, processes=args.processes))))
+    if args.trace is not None:
+        trace.dump(args.trace)
+        print(trace.summary())
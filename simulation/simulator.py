@@ -0,0 +1,98 @@
+import time
+from typing import List, NamedTuple, Optional
+
+import numpy as np
+
+from algorithm import trace
+from board.board import Board
+from board.controller import AutoController
+from simulation.arrival import Arrival
+from simulation.recording import Recorder
+
+
+class Episode(NamedTuple):
+    finished: bool  # every customer was served
+    num_steps: int
+    num_replans: int
+    planning_time: float  # seconds spent in the controller
+    max_planning_time: float  # seconds of the slowest replan
+    path_length: List[int]  # number of moves of each salesman
+    num_customers: int  # at the start of the episode
+    num_salesmen: int  # at the start of the episode
+    num_served: int  # customers picked up, arrivals included
+    wait_time: List[int]  # ticks from arrival (tick 0 for the initial customers) to pickup of each served customer
+    replan_time: List[float]  # seconds of each call of the controller
+
+
+def simulate(board: Board, auto_controller: AutoController, max_steps: Optional[int] = None,
+             recorder: Optional[Recorder] = None, arrival: Optional[Arrival] = None) -> Episode:
+    '''
+    run an episode without rendering, like game.Game.loop with an auto controller
+    the episode ends when all customers or all salesmen are gone, when a tick moves no salesman or after max_steps
+    with arrivals customers keep coming, the episode runs max_steps ticks unless the salesmen are gone
+    :param board: board at the start of the episode, modified in place
+    :param auto_controller: auto controller
+    :param max_steps: step limit, unlimited if None, required with arrivals
+    :param recorder: records every step of the board and the arrivals
+    :param arrival: customers added before every tick, they are dispatched to the salesmen without a goal
+    :return: episode statistics
+    '''
+    if arrival is not None and max_steps is None:
+        raise ValueError("an episode with arrivals needs max_steps")
+    planning_time_list: List[float] = []
+
+    def timed_controller(*args):
+        t0 = time.perf_counter()
+        path_list = auto_controller(*args)
+        planning_time_list.append(time.perf_counter() - t0)
+        if trace.enabled():
+            trace.record("replan", t0, planning_time_list[-1])
+        return path_list
+
+    num_customers, num_salesmen = len(board.customer), len(board.salesman)
+    path_length = np.zeros(shape=(num_salesmen,), dtype=int)
+    width = board.shape[1]
+    # cell and arrival tick of every customer on the board
+    waiting_cell = board.customer[:, 0] * width + board.customer[:, 1]
+    waiting_tick = np.zeros(shape=(len(waiting_cell),), dtype=int)
+    wait_time_list: List[np.ndarray] = []
+    num_steps = 0
+    while (len(board.customer) > 0 or arrival is not None) and len(board.salesman) > 0:
+        if max_steps is not None and num_steps >= max_steps:
+            break
+        if arrival is not None:
+            accepted = board.add_customer(arrival(num_steps, board))
+            if recorder is not None:
+                recorder.arrive(accepted)
+            waiting_cell = np.concatenate([waiting_cell, accepted[:, 0] * width + accepted[:, 1]])
+            waiting_tick = np.concatenate([waiting_tick, np.full(shape=(len(accepted),), fill_value=num_steps)])
+        last_salesman = board.salesman.copy()
+        board.control_auto(timed_controller)
+        num_steps += 1
+        served = ~np.isin(waiting_cell, board.customer[:, 0] * width + board.customer[:, 1])
+        if served.any():
+            wait_time_list.append(num_steps - waiting_tick[served])
+            waiting_cell, waiting_tick = waiting_cell[~served], waiting_tick[~served]
+        if recorder is not None:
+            recorder.record()
+        if len(board.salesman) != len(last_salesman):  # salesmen were removed, lengths are lost
+            break
+        moved = (board.salesman != last_salesman).any(axis=1)
+        path_length += moved
+        if not moved.any() and arrival is None:  # stuck, remaining customers are unreachable
+            break
+
+    wait_time = np.concatenate([np.zeros(shape=(0,), dtype=int), *wait_time_list])
+    return Episode(
+        finished=len(board.customer) == 0,
+        num_steps=num_steps,
+        num_replans=len(planning_time_list),
+        planning_time=sum(planning_time_list),
+        max_planning_time=max(planning_time_list, default=0.0),
+        path_length=path_length.tolist(),
+        num_customers=num_customers,
+        num_salesmen=num_salesmen,
+        num_served=len(wait_time),
+        wait_time=wait_time.tolist(),
+        replan_time=planning_time_list,
+    )
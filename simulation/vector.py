@@ -0,0 +1,149 @@
+from typing import List, Tuple, Optional
+
+import numpy as np
+
+from algorithm.grid import Grid
+from board.controller import AutoController
+from board.generator import random_board
+from game.global_controller import SHIFT_VECTOR
+
+
+class VectorBoard(object):
+    '''
+    many boards of the same shape stepped in lockstep, with the rules of board.board.Board
+    salesmen keep their slot when they are removed, so that every board has the same number of salesman slots
+    '''
+    num_boards: int
+    shape: Tuple[int, int]  # hw
+    count: Tuple[int, int, int]  # obstacles, customers, salesmen of a random board
+    reachable: bool
+    obstacle: np.ndarray  # (num_boards, h, w) True on obstacle
+    customer: np.ndarray  # (num_boards, h, w) True on customer
+    salesman: np.ndarray  # (num_boards, num_salesmen, 2) hw
+    alive: np.ndarray  # (num_boards, num_salesmen) False once a salesman is removed
+
+    # graph of each board, built on the first auto step
+    graph: List[Optional[Grid]]
+    # controller cache: path[b, s, cursor[b, s]:length[b, s]] are the flat cells salesman s still has to visit
+    path: np.ndarray  # (num_boards, num_salesmen, max_length)
+    length: np.ndarray  # (num_boards, num_salesmen)
+    cursor: np.ndarray  # (num_boards, num_salesmen)
+    replan: np.ndarray  # (num_boards,) the cached paths of the board are stale
+
+    def __init__(self, num_boards: int, shape: Tuple[int, int], obstacle: int, customer: int, salesman: int,
+                 reachable: bool = False, rng: Optional[np.random.Generator] = None):
+        super(VectorBoard, self).__init__()
+        self.num_boards = num_boards
+        self.shape = shape
+        self.count = (obstacle, customer, salesman)
+        self.reachable = reachable
+        self.reset(rng)
+
+    def reset(self, rng: Optional[np.random.Generator] = None):
+        '''
+        draw new random boards
+        '''
+        if rng is None:
+            rng = np.random.default_rng()
+        height, width = self.shape
+        num_salesmen = self.count[2]
+        self.obstacle = np.zeros(shape=(self.num_boards, height, width), dtype=bool)
+        self.customer = np.zeros(shape=(self.num_boards, height, width), dtype=bool)
+        self.salesman = np.zeros(shape=(self.num_boards, num_salesmen, 2), dtype=int)
+        for b in range(self.num_boards):
+            obstacle, customer, salesman = random_board(self.shape, *self.count, rng, self.reachable)
+            self.obstacle[b][tuple(obstacle.T)] = True
+            self.customer[b][tuple(customer.T)] = True
+            self.salesman[b] = salesman
+        self.alive = np.ones(shape=(self.num_boards, num_salesmen), dtype=bool)
+        self.graph = [None] * self.num_boards
+        self.path = np.zeros(shape=(self.num_boards, num_salesmen, 1), dtype=np.int32)
+        self.length = np.zeros(shape=(self.num_boards, num_salesmen), dtype=np.int32)
+        self.cursor = np.zeros(shape=(self.num_boards, num_salesmen), dtype=np.int32)
+        self.replan = np.ones(shape=(self.num_boards,), dtype=bool)
+        self.__ensure_valid()
+
+    def observe(self) -> np.ndarray:
+        '''
+        :return: (num_boards, 3, h, w) obstacle, customer and salesman layers
+        '''
+        salesman = np.zeros_like(self.customer)
+        b, s = np.nonzero(self.alive)
+        salesman[b, self.salesman[b, s, 0], self.salesman[b, s, 1]] = True
+        return np.stack([self.obstacle, self.customer, salesman], axis=1)
+
+    def done(self) -> np.ndarray:
+        '''
+        :return: (num_boards,) True if all customers or all salesmen are gone
+        '''
+        return ~self.customer.any(axis=(1, 2)) | ~self.alive.any(axis=1)
+
+    def step(self, shift: np.ndarray) -> np.ndarray:
+        '''
+        move every salesman like board.board.Board.control_force
+        :param shift: (num_boards, 2) shift of all salesmen of a board or (num_boards, num_salesmen, 2) per salesman,
+                      see game.global_controller.SHIFT_VECTOR
+        :return: (num_boards,) number of customers picked up
+        '''
+        shift = np.asarray(shift, dtype=int)
+        if shift.ndim == 2:
+            shift = shift[:, None, :]
+        self.salesman[self.alive] = (self.salesman + shift)[self.alive]
+        self.replan[:] = True
+        return self.__ensure_valid()
+
+    def step_command(self, command_list: List[str]) -> np.ndarray:
+        '''
+        step with one game.global_controller command per board
+        '''
+        return self.step(np.array([SHIFT_VECTOR.get(command, (0, 0)) for command in command_list], dtype=int))
+
+    def step_auto(self, controller: AutoController) -> np.ndarray:
+        '''
+        move every salesman like board.board.Board.control_auto, the controller only runs on boards that replan
+        :return: (num_boards,) number of customers picked up
+        '''
+        for b in np.flatnonzero(self.replan & ~self.done()):
+            self.__plan(b, controller)
+        self.replan[:] = False
+        # a salesman with at least one cell left on its path moves, the board replans once a path is finished
+        move = self.alive & (self.length - self.cursor >= 2)
+        b, s = np.nonzero(move)
+        self.cursor[b, s] += 1
+        self.salesman[b, s] = np.stack(np.divmod(self.path[b, s, self.cursor[b, s]], self.shape[1]), axis=1)
+        self.replan |= (move & (self.length - self.cursor == 1)).any(axis=1)
+        return self.__ensure_valid()
+
+    def __plan(self, b: int, controller: AutoController):
+        if self.graph[b] is None:
+            self.graph[b] = Grid(~self.obstacle[b])
+        graph = self.graph[b]
+        agent = np.flatnonzero(self.alive[b])
+        salesman_list = graph.coord2index[self.salesman[b, agent, 0], self.salesman[b, agent, 1]].tolist()
+        customer_list = graph.coord2index[self.customer[b]].tolist()
+        index_path_list = controller(graph, salesman_list, customer_list)
+        max_length = max(len(index_path) for index_path in index_path_list)
+        if max_length > self.path.shape[2]:
+            self.path = np.concatenate([self.path, np.zeros(
+                shape=(self.num_boards, self.path.shape[1], max_length - self.path.shape[2]), dtype=np.int32,
+            )], axis=2)
+        for s, index_path in zip(agent, index_path_list):
+            h, w = graph.index2coord[np.asarray(index_path, dtype=int)].T
+            self.path[b, s, :len(index_path)] = h * self.shape[1] + w
+            self.length[b, s] = len(index_path)
+        self.cursor[b] = 0
+
+    def __ensure_valid(self) -> np.ndarray:
+        height, width = self.shape
+        # remove all invalid salesman: outside of the map or on an obstacle
+        h, w = self.salesman[:, :, 0], self.salesman[:, :, 1]
+        in_range = (h >= 0) & (h < height) & (w >= 0) & (w < width)
+        board = np.broadcast_to(np.arange(self.num_boards)[:, None], in_range.shape)
+        flat = (board * height + np.clip(h, 0, height - 1)) * width + np.clip(w, 0, width - 1)
+        self.alive &= in_range & ~self.obstacle.reshape(-1)[flat]
+        # remove all invalid customer: on a salesman
+        customer = self.customer.reshape(-1)
+        flat = flat[self.alive]
+        picked = np.unique(flat[customer[flat]])
+        customer[picked] = False
+        return np.bincount(picked // (height * width), minlength=self.num_boards)